@@ -10,14 +10,628 @@ You are free to use, modify and distribute the code, though recognition of my ef
 from __future__ import print_function
 import sys
 import os.path
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+import glob
+import time
+import argparse
+import multiprocessing
+import io
+import functools
+import json
+import csv
+import pickle
+import copy
+import concurrent.futures
+import cProfile
+import hashlib
+import tempfile
+import pathlib
+import re
+import bisect
+import numpy as np
+
+# matplotlib is only imported once something is drawn, see ImportMatplotlib
+plt = None
+LineCollection = PolyCollection = to_rgb = FontProperties = MathTextParser = TexManager = TextToPath = TextCollection = None
+OffsetImage = AnnotationBbox = Text = FallbackText = None
+
+# extensions of the output file that matplotlib can write directly
+OUTPUT_FORMATS = ('.pdf', '.eps', '.ps', '.png', '.svg')
 
 def getEnergy(state):
     # sort key
     return state.energy
 
+def SpreadLabels(positions, spacing, lower, upper):
+    """
+    Moves label positions as little as possible (least squares) so that
+    neighbouring labels are at least `spacing` apart and all of them lie
+    within [lower, upper]. Positions are returned in the input order.
+    `spacing` may also be an array, the room each label needs; two
+    neighbours are then kept the mean of their spacings apart.
+
+    With z_i = y_i - i*spacing for the sorted positions the spacing constraint
+    becomes z non-decreasing, so the problem is an isotonic regression solved
+    by pool-adjacent-violators in a single pass; clipping the fit to the
+    bounds keeps it optimal. Cost is the sort, O(n log n), and it always ends.
+    """
+    positions = np.asarray(positions, dtype=float)
+    n = len(positions)
+    if n == 0:
+        return positions.copy()
+    order = np.argsort(positions, kind='stable')
+    if np.ndim(spacing) == 0:
+        offsets = np.arange(n) * spacing
+    else:
+        room = np.asarray(spacing, dtype=float)[order]
+        offsets = np.concatenate([[0.0], np.cumsum(0.5 * (room[:-1] + room[1:]))])
+    z = positions[order] - offsets
+
+    # pool adjacent violators: merge blocks while their means decrease
+    sums = np.empty(n)
+    counts = np.empty(n, dtype=int)
+    blocks = 0
+    for value in z:
+        sums[blocks] = value
+        counts[blocks] = 1
+        blocks += 1
+        while blocks > 1 and sums[blocks-2]*counts[blocks-1] > sums[blocks-1]*counts[blocks-2]:
+            sums[blocks-2] += sums[blocks-1]
+            counts[blocks-2] += counts[blocks-1]
+            blocks -= 1
+    fitted = np.repeat(sums[:blocks] / counts[:blocks], counts[:blocks])
+    # roof wins over the floor when the labels cannot fit at all
+    fitted = np.clip(fitted, lower, upper - offsets[-1])
+
+    spread = np.empty(n)
+    spread[order] = fitted + offsets
+    return spread
+
+class GridIndex:
+    """
+    Uniform grid over axis-aligned boxes (x0, y0, x1, y1). Every box is
+    filed under the cells it covers, so finding the boxes that touch a
+    region only looks at the cells of that region instead of every box.
+    """
+    def __init__(self, cellWidth, cellHeight):
+        self.cellWidth = float(cellWidth)
+        self.cellHeight = float(cellHeight)
+        self.boxes = []
+        self.cells = {}
+
+    def _Range(self, x0, y0, x1, y1):
+        return (range(int(np.floor(x0 / self.cellWidth)), int(np.floor(x1 / self.cellWidth)) + 1),
+                range(int(np.floor(y0 / self.cellHeight)), int(np.floor(y1 / self.cellHeight)) + 1))
+
+    def Insert(self, box):
+        # returns the number of the box, Query gives these numbers back
+        number = len(self.boxes)
+        self.boxes.append(box)
+        columns, rows = self._Range(*box)
+        for i in columns:
+            for j in rows:
+                self.cells.setdefault((i, j), []).append(number)
+        return number
+
+    def Query(self, x0, y0, x1, y1):
+        # numbers of the boxes that overlap the region, edges included
+        found = set()
+        columns, rows = self._Range(x0, y0, x1, y1)
+        for i in columns:
+            for j in rows:
+                for number in self.cells.get((i, j), ()):
+                    if number in found:
+                        continue
+                    bx0, by0, bx1, by1 = self.boxes[number]
+                    if bx0 <= x1 and x0 <= bx1 and by0 <= y1 and y0 <= by1:
+                        found.add(number)
+        return found
+
+    def SegmentHits(self, p, q):
+        # True when the segment from p to q crosses any box; only the cells
+        # the segment passes through are looked at
+        (x0, y0), (x1, y1) = sorted([p, q])
+        seen = set()
+        for i in range(int(np.floor(x0 / self.cellWidth)), int(np.floor(x1 / self.cellWidth)) + 1):
+            # the part of the segment within this column of cells
+            if x1 == x0:
+                ya, yb = y0, y1
+            else:
+                slope = (y1 - y0) / (x1 - x0)
+                ya = y0 + (max(x0, i*self.cellWidth) - x0) * slope
+                yb = y0 + (min(x1, (i+1)*self.cellWidth) - x0) * slope
+            for j in range(int(np.floor(min(ya, yb) / self.cellHeight)), int(np.floor(max(ya, yb) / self.cellHeight)) + 1):
+                for number in self.cells.get((i, j), ()):
+                    if number in seen:
+                        continue
+                    seen.add(number)
+                    if SegmentHitsBox(p, q, self.boxes[number]):
+                        return True
+        return False
+
+def SegmentHitsBox(p, q, box):
+    # Liang-Barsky clipping of the segment against the box
+    x0, y0, x1, y1 = box
+    dx, dy = q[0] - p[0], q[1] - p[1]
+    low, high = 0.0, 1.0
+    for step, start, lower, upper in ((dx, p[0], x0, x1), (dy, p[1], y0, y1)):
+        if step == 0.0:
+            if start < lower or start > upper:
+                return False
+            continue
+        t0, t1 = (lower - start) / step, (upper - start) / step
+        if t0 > t1:
+            t0, t1 = t1, t0
+        low, high = max(low, t0), min(high, t1)
+        if low > high:
+            return False
+    return True
+
+def FreeIntervals(blocked, gap, lower, upper):
+    """
+    Parts of [lower, upper] left free by the blocked (low, high) intervals,
+    each widened by gap, as two sorted lists of interval starts and ends.
+    """
+    lows, highs = [], []
+    current = lower
+    for low, high in sorted(blocked):
+        if low - gap > current:
+            lows.append(current)
+            highs.append(min(low - gap, upper))
+        current = max(current, high + gap)
+        if current >= upper:
+            break
+    if current < upper:
+        lows.append(current)
+        highs.append(upper)
+    return lows, highs
+
+def NearestFree(lows, highs, y):
+    # point of the free intervals closest to y, None when nothing is free
+    i = bisect.bisect_right(lows, y) - 1
+    if i >= 0 and y <= highs[i]:
+        return y
+    candidates = []
+    if i >= 0:
+        candidates.append(highs[i])
+    if i + 1 < len(lows):
+        candidates.append(lows[i + 1])
+    if not candidates:
+        return None
+    return min(candidates, key=lambda lane: abs(lane - y))
+
+def ImportMatplotlib():
+    """
+    Imports matplotlib the first time something is drawn or measured, so
+    reading and checking input files stays fast. Returns pyplot.
+    """
+    global plt, LineCollection, PolyCollection, to_rgb, FontProperties, MathTextParser, TexManager, TextToPath, TextCollection
+    global OffsetImage, AnnotationBbox, Text, FallbackText
+    if plt is not None:
+        return plt
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as pyplot
+    from matplotlib.artist import Artist
+    from matplotlib.collections import LineCollection, PolyCollection
+    from matplotlib.colors import to_rgb
+    from matplotlib.font_manager import FontProperties
+    from matplotlib.mathtext import MathTextParser
+    from matplotlib.offsetbox import OffsetImage, AnnotationBbox
+    from matplotlib.text import Text
+    from matplotlib.texmanager import TexManager
+    from matplotlib.textpath import TextToPath
+
+    class FallbackText(Text):
+        # a Text that goes to LaTeX when mathtext cannot typeset it
+        def draw(self, renderer):
+            DrawText(self, renderer)
+
+    class TextCollection(Artist):
+        """
+        Many strings drawn by a single artist. One Text object is moved around
+        and drawn once per string, so the number of artists in the figure does
+        not grow with the number of states.
+        """
+        def __init__(self, x, y, strings, colors, usetex=None, **textProps):
+            Artist.__init__(self)
+            self._text = Text(**textProps)
+            # strings mathtext failed on, they are drawn with LaTeX from then on
+            self.needsTex = set()
+            self.SetData(x, y, strings, colors, usetex)
+
+        def SetData(self, x, y, strings, colors, usetex=None):
+            self.x = np.asarray(x, dtype=float)
+            self.y = np.asarray(y, dtype=float)
+            self.strings = list(strings)
+            self.colors = list(colors)
+            # per string choice between TeX and mathtext, None follows rcParams
+            if usetex is None:
+                usetex = [None] * len(self.strings)
+            self.usetex = list(usetex)
+            self.stale = True
+
+        def set_figure(self, fig):
+            Artist.set_figure(self, fig)
+            self._text.set_figure(fig)
+
+        def set_transform(self, t):
+            Artist.set_transform(self, t)
+            self._text.set_transform(t)
+
+        def draw(self, renderer):
+            if not self.get_visible():
+                return
+            text = self._text
+            for x, y, string, color, usetex in zip(self.x, self.y, self.strings, self.colors, self.usetex):
+                text.set_position((x, y))
+                text.set_text(string)
+                text.set_color(color)
+                text.set_usetex(True if string in self.needsTex else usetex)
+                if DrawText(text, renderer):
+                    self.needsTex.add(string)
+            self.stale = False
+
+    plt = pyplot
+    return plt
+
+def DrawText(text, renderer):
+    """
+    Draws a Text; when mathtext cannot parse it the text is drawn again with
+    LaTeX, which is then kept for it. Returns True when LaTeX was needed.
+    Labels are not checked beforehand, a parse costs as much as a draw.
+    """
+    try:
+        Text.draw(text, renderer)
+    except ValueError:
+        if text.get_usetex():
+            raise
+        text.set_usetex(True)
+        Text.draw(text, renderer)
+        return True
+    return False
+
+class LabelCache:
+    """
+    Size-limited home for the files TeX makes for label strings. Install()
+    points matplotlib's own TeX cache at the directory, so entries keep
+    matplotlib's names (a hash of the full TeX source, fonts and preamble
+    included) and nothing is written twice; the least recently used files
+    are removed once the directory grows over maxBytes.
+    """
+    def __init__(self, directory, maxBytes=64*1024*1024):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        # time spent waiting for TeX on misses
+        self.texSeconds = 0.0
+        self._make_dvi = None
+        self._make_png = None
+        self._texcache = None
+        # set while a fetch runs, make_png calls make_dvi itself
+        self._fetching = False
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def Fetch(self, path, make):
+        # path is where matplotlib keeps the file, make runs TeX for it
+        if self._fetching:
+            # the dvi made for a png, counted and timed with the png
+            return make()
+        hit = os.path.exists(path)
+        if hit:
+            # a hit refreshes the entry for the LRU order
+            os.utime(path)
+            self.hits += 1
+        else:
+            self.misses += 1
+        start = time.perf_counter()
+        self._fetching = True
+        try:
+            made = make()
+        finally:
+            self._fetching = False
+        if hit:
+            return made
+        self.texSeconds += time.perf_counter() - start
+        self.Prune()
+        return made
+
+    def Prune(self):
+        # remove least recently used files until the cache fits in maxBytes
+        entries = []
+        total = 0
+        for root, directories, files in os.walk(self.directory):
+            # matplotlib runs TeX in tmp* directories next to the results
+            directories[:] = [name for name in directories if not name.startswith('tmp')]
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((info.st_mtime, info.st_size, path))
+                total += info.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def Install(self):
+        if self._make_dvi is not None:
+            return
+        ImportMatplotlib()
+        # matplotlib >= 3.8 keeps a Path in _cache_dir, older ones a str in texcache
+        if hasattr(TexManager, '_cache_dir'):
+            self._texcache = ('_cache_dir', TexManager._cache_dir)
+            TexManager._cache_dir = pathlib.Path(self.directory)
+        else:
+            self._texcache = ('texcache', TexManager.texcache)
+            TexManager.texcache = self.directory
+        cache = self
+        make_dvi = TexManager.make_dvi
+        make_png = TexManager.make_png
+        def cached_dvi(cls, tex, fontsize):
+            return cache.Fetch(TexManager.get_basefile(tex, fontsize) + ".dvi",
+                               lambda: make_dvi(tex, fontsize))
+        def cached_png(cls, tex, fontsize, dpi):
+            return cache.Fetch(TexManager.get_basefile(tex, fontsize, dpi) + ".png",
+                               lambda: make_png(tex, fontsize, dpi))
+        self._make_dvi = make_dvi
+        self._make_png = make_png
+        TexManager.make_dvi = classmethod(cached_dvi)
+        TexManager.make_png = classmethod(cached_png)
+
+    def Uninstall(self):
+        if self._make_dvi is None:
+            return
+        TexManager.make_dvi = classmethod(self._make_dvi.__func__)
+        TexManager.make_png = classmethod(self._make_png.__func__)
+        setattr(TexManager, *self._texcache)
+        self._make_dvi = None
+        self._make_png = None
+        self._texcache = None
+
+# the cache used by this process, see UseLabelCache
+_labelCache = None
+
+def UseLabelCache(directory, maxBytes):
+    global _labelCache
+    if _labelCache is not None and _labelCache.directory == directory:
+        _labelCache.maxBytes = maxBytes
+        return _labelCache
+    if _labelCache is not None:
+        _labelCache.Uninstall()
+    _labelCache = LabelCache(directory, maxBytes)
+    _labelCache.Install()
+    return _labelCache
+
+class ImageCache:
+    """
+    Pictures for the IMAGE key, keyed by path and modification time. Each
+    file is decoded once, when it is first drawn, and only a copy reduced
+    to the resolution needed in the output is kept, however many states
+    show it. The maxEntries most recently used pictures are kept.
+    """
+    def __init__(self, maxEntries=32):
+        self.maxEntries = maxEntries
+        self.decodes = 0
+        self.hits = 0
+        # key -> (pixels, fraction of the full resolution), oldest first
+        self.entries = {}
+
+    def Fetch(self, path, factor):
+        """
+        Returns (pixels, fraction) with at least `factor` of the full
+        resolution of the file (never more than all of it). An OffsetImage
+        of the pixels with zoom=scale/fraction has the size of the full
+        picture at zoom=scale.
+        """
+        key = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+        factor = min(factor, 1.0)
+        entry = self.entries.pop(key, None)
+        if entry is not None and entry[1] >= factor:
+            self.hits += 1
+        else:
+            self.decodes += 1
+            entry = DecodeImage(path, factor)
+        self.entries[key] = entry
+        while len(self.entries) > self.maxEntries:
+            del self.entries[next(iter(self.entries))]
+        return entry
+
+def DecodeImage(path, factor):
+    # decode an image file at a fraction of its resolution, see ImageCache
+    from PIL import Image
+    with Image.open(path) as image:
+        width, height = image.size
+        size = (max(1, int(np.ceil(width * factor))), max(1, int(np.ceil(height * factor))))
+        if size[0] < width:
+            # JPEG can skip most of the decoding at reduced sizes
+            image.draft(image.mode, size)
+            if image.mode not in ("RGB", "RGBA", "L"):
+                image = image.convert("RGBA")
+            image = image.resize(size, Image.LANCZOS)
+        elif image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGBA")
+        pixels = np.asarray(image)
+    return pixels, pixels.shape[1] / float(width)
+
+# pictures shared by all diagrams of this process
+_imageCache = ImageCache()
+
+_mathtextParser = None
+
+@functools.lru_cache(maxsize=4096)
+def MathtextCanRender(string):
+    # True when matplotlib's own mathtext can typeset the string without TeX
+    global _mathtextParser
+    if string.count("$") < 2:
+        # no math at all, plain text
+        return True
+    if _mathtextParser is None:
+        ImportMatplotlib()
+        _mathtextParser = MathTextParser('path')
+    try:
+        _mathtextParser.parse(string)
+    except ValueError:
+        return False
+    return True
+
+_textToPath = None
+
+@functools.lru_cache(maxsize=None)
+def TextExtent(string, fontSize, family='serif'):
+    """
+    (width, height, descent) of a string in points, from the font metrics
+    alone, so no renderer or canvas draw is needed. Math is measured with
+    mathtext, which is close enough to LaTeX for layout purposes.
+    """
+    global _textToPath
+    if _textToPath is None:
+        ImportMatplotlib()
+        _textToPath = TextToPath()
+    prop = FontProperties(family=family, size=fontSize)
+    ismath = string.count("$") >= 2
+    try:
+        width, height, descent = _textToPath.get_text_width_height_descent(string, prop, ismath)
+    except ValueError:
+        # mathtext could not parse it, measure the raw characters instead
+        width, height, descent = _textToPath.get_text_width_height_descent(string, prop, False)
+    return float(width), float(height), float(descent)
+
+# mathtext draws sub- and superscripts at this fraction of the font size
+SCRIPT_SCALE = 0.7
+# commands that change the font or spacing but draw nothing themselves
+MATH_FONT_COMMANDS = ('mathrm', 'mathit', 'mathbf', 'mathsf', 'mathtt', 'mathcal',
+                      'rm', 'it', 'bf', 'text', 'left', 'right', 'displaystyle')
+
+@functools.lru_cache(maxsize=None)
+def GlyphWidth(char, fontSize, family='serif'):
+    return TextExtent(char, fontSize, family)[0]
+
+@functools.lru_cache(maxsize=65536)
+def LabelExtent(string, fontSize, family='serif'):
+    """
+    (width, height) of a one-line string in points for the layout. Plain
+    text is measured exactly with TextExtent; math, which takes a full
+    mathtext parse to measure, is estimated from the cached width of each
+    glyph with the markup dropped and scripts counted at SCRIPT_SCALE.
+    """
+    if string.count("$") < 2:
+        width, height, _ = TextExtent(string, fontSize, family)
+        return width, height
+    width = 0.0
+    math = False
+    scales = [1.0]
+    # scale for the next single glyph after ^ or _
+    script = None
+    scripts = False
+    i = 0
+    while i < len(string):
+        char = string[i]
+        i += 1
+        if char == "$":
+            math = not math
+            continue
+        if math and char in "^_":
+            script = scales[-1] * SCRIPT_SCALE
+            scripts = True
+            continue
+        if math and char == "{":
+            scales.append(script if script is not None else scales[-1])
+            script = None
+            continue
+        if math and char == "}":
+            if len(scales) > 1:
+                scales.pop()
+            continue
+        scale = script if script is not None else scales[-1]
+        script = None
+        if math and char == "\\":
+            command = re.match(r"[A-Za-z]+|.?", string[i:]).group(0)
+            i += len(command)
+            if command in MATH_FONT_COMMANDS or not command.isalpha():
+                continue
+            # a symbol such as \alpha, about as wide as an x
+            char = "x"
+        if math and char == " ":
+            continue
+        width += GlyphWidth(char, fontSize, family) * scale
+    height = TextExtent("Ag", fontSize, family)[1]
+    if scripts:
+        # scripts stick out a little above and below the line
+        height *= 1.15
+    return width, height
+
+class Profiler:
+    """
+    Collects wall and CPU time for every stage of a run, plus counters read
+    from the finished diagram. Report() gives the data as a dict ready for
+    json; with cprofileOutput set the whole run is also run under cProfile
+    and its statistics dumped to that file.
+    """
+    def __init__(self, cprofileOutput=None):
+        self.cprofileOutput = cprofileOutput
+        self.stages = []
+        self.counters = {}
+        self._profile = None
+        self._start = None
+        self._latex = (0, 0, 0.0)
+
+    def Start(self):
+        self._start = (time.perf_counter(), time.process_time())
+        self._latex = (0, 0, 0.0)
+        if _labelCache is not None:
+            self._latex = (_labelCache.hits, _labelCache.misses, _labelCache.texSeconds)
+        if self.cprofileOutput is not None:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def Time(self, name, function, *args, **kwargs):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.stages.append({"name": name,
+                                "wall": time.perf_counter() - wall,
+                                "cpu": time.process_time() - cpu})
+
+    def Finish(self, diagram):
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.cprofileOutput)
+            self._profile = None
+        wall, cpu = self._start
+        self.counters["total"] = {"wall": time.perf_counter() - wall, "cpu": time.process_time() - cpu}
+        if diagram is None:
+            return
+        self.counters["output"] = ", ".join(diagram.OutputNames())
+        self.counters["states"] = len(diagram.statesList)
+        # columns are counted from 1 as in the input file
+        self.counters["labelIterations"] = {str(c+1): n for c, n in sorted(diagram.labelIterations.items())}
+        self.counters["canvasDraws"] = diagram.renderCount
+        if diagram.fig is not None:
+            self.counters["artists"] = len(diagram.fig.findobj()) - 1
+        if _labelCache is not None:
+            hits, misses, seconds = self._latex
+            self.counters["latex"] = {"hits": _labelCache.hits - hits,
+                                      "misses": _labelCache.misses - misses,
+                                      "seconds": _labelCache.texSeconds - seconds}
+
+    def Report(self):
+        report = {"stages": self.stages}
+        report.update(self.counters)
+        if self.cprofileOutput is not None:
+            report["cprofile"] = self.cprofileOutput
+        return report
+
 class Diagram:
     """
     Holds global values for the diagram and handles drawing.
@@ -26,24 +640,53 @@ class Diagram:
         self.width = width
         self.height = height
         self.outputName = outputName
-        # latex font 
-        plt.rcParams.update({'font.size': fontSize})
-        plt.rcParams.update({'font.family': 'serif'})
-        plt.rcParams.update({'text.usetex': True})
+        # e.g. ['pdf', 'png'] to save several formats, None follows outputName
+        self.formats = None
+        self.fontSize = fontSize
+        # 'usetex' sends every text through LaTeX, 'mathtext' only the
+        # labels that matplotlib's mathtext cannot typeset
+        self.renderMode = "usetex"
 
         # to be upgraded once I know all the answers
         # size of a font in the axis coordinates units
         self.fontSpacing = 0.12
         # extra space between text -- this is only a scaling factor
         self.interspacing = 0.4
+        # 'isotonic' solves label overlaps in one pass, 'iterative' is the old loop
+        self.labelSolver = "isotonic"
+        # draw all bars, connectors and texts with a fixed number of artists
+        self.useCollections = True
+
+        # made by MakeFigure, once the render mode is known
+        self.fig = None
+        self.ax = None
+        # number of times the figure was rasterized or vectorized
+        self.renderCount = 0
+        self.xlim = None
+        self.ylim = None
+        # same relative margin as matplotlib's autoscaling
+        self.yMargin = 0.05
+        # (low, high) energies the axis must show whatever the states are,
+        # so the frames of a sequence share one axis
+        self.energyRange = None
+        # states closer than bandThreshold are merged into bands, see MakeBands
+        self.bandThreshold = None
+        self.bandMinStates = 3
+        # name of a merged state -> name of its band
+        self.bandMembers = {}
+        # column -> passes the label solver needed, and the optional Profiler
+        self.labelIterations = {}
+        self.profiler = None
 
-        #self.fig = plt.figure(figsize=(self.width, self.height))
-        self.fig = plt.figure()
-        self.ax = self.fig.add_subplot(111)
-       
         self.columnWidth = 1.0
+        # distance between the left ends of neighbouring columns and the room
+        # right of the last column; FitColumns widens them to fit the labels
+        self.columnSpacing = 1.5 * self.columnWidth
+        self.rightMargin = 0.5 * self.columnWidth
         
         self.statesList  = {}
+        # column number -> states in that column, filled by AddState
+        self.columnIndex = {}
         self.dashes      = [6.0,3.0] # ink, skip
         self.columns     = 0
         self.energyUnits = ""
@@ -60,35 +703,127 @@ class Diagram:
             self.do_legend = True
         if state.name not in self.statesList:
             self.statesList[state.name] = state
+            self.columnIndex.setdefault(state.column, []).append(state)
         else:
             print("ERROR: States must have unique names. State " + state.name + " is already in use!")
             raise ValueError("Non unique state names.")
 
-    def MakeLeftRightPoints(self):
-        columnWidth = self.columnWidth
+    def MakeFigure(self):
+        ImportMatplotlib()
+        # latex font 
+        plt.rcParams.update({'font.size': self.fontSize})
+        plt.rcParams.update({'font.family': 'serif'})
+        if self.renderMode == "usetex":
+            plt.rcParams.update({'text.usetex': True})
+        elif self.renderMode == "mathtext":
+            plt.rcParams.update({'text.usetex': False})
+            plt.rcParams.update({'mathtext.fontset': 'cm'})
+        else:
+            raise ValueError("Unknown render mode: " + str(self.renderMode))
+        #self.fig = plt.figure(figsize=(self.width, self.height))
+        self.fig = plt.figure()
+        self.ax = self.fig.add_subplot(111)
+        self.renderCount = 0
+        self.fig.canvas.mpl_connect('draw_event', self._CountRender)
+
+    def _CountRender(self, event):
+        self.renderCount += 1
 
+    def UseTex(self, string):
+        # for texts matplotlib makes itself (the axis label); None keeps the
+        # default from rcParams
+        if self.renderMode == "mathtext" and not MathtextCanRender(string):
+            return True
+        return None
+
+    def MakeBands(self):
+        """
+        Level of detail for dense manifolds: in every column, runs of at least
+        bandMinStates states whose neighbours are closer than a threshold are
+        replaced by one band state, drawn as a shaded box with a single label
+        giving the count and the energy range. The threshold starts at
+        bandThreshold and is doubled, column by column, until the labels that
+        are left fit between the limits of the energy axis. A run goes on as
+        long as neighbours are close (single linkage), so a band of evenly
+        spread states can be many thresholds wide; its label gives the range.
+        """
+        if not self.bandThreshold or len(self.statesList) == 0:
+            return
+        # the same room FindLabelPosition has for the labels of a column
+        self.ComputeLimits()
+        height = self.ylim[1] - self.fontSpacing - self.ylim[0]
+        spacing = self.fontSpacing * (1.0 + self.interspacing)
+        for c in list(self.columnIndex):
+            column = sorted(self.columnIndex[c], key=getEnergy)
+            energies = np.fromiter((state.energy for state in column), dtype=float, count=len(column))
+            threshold = self.bandThreshold
+            while True:
+                breaks = np.flatnonzero(np.diff(energies) >= threshold) + 1
+                starts, stops = np.r_[0, breaks], np.r_[breaks, len(column)]
+                merged = stops - starts >= self.bandMinStates
+                # a band label takes two lines, neighbours share the room between them
+                rooms = np.where(merged, 2.0*spacing, (stops - starts)*spacing)
+                first = 2.0*spacing if merged[0] else spacing
+                last = 2.0*spacing if merged[-1] else spacing
+                if rooms.sum() - 0.5*(first + last) <= height or len(breaks) == 0:
+                    break
+                threshold *= 2.0
+            kept = []
+            for k, (start, stop) in enumerate(zip(starts, stops)):
+                if stop - start < self.bandMinStates:
+                    kept.extend(column[start:stop])
+                    continue
+                low, high = energies[start], energies[stop-1]
+                band = State()
+                band.name = "BAND {:}.{:}".format(c+1, k+1)
+                band.color = column[start].color
+                band.labelColor = column[start].labelColor
+                band.label = "{:} states".format(stop - start)
+                band.energy = 0.5 * (low + high)
+                band.column = c
+                band.band = (float(low), float(high), int(stop - start))
+                # links of the merged states start from the band
+                band.linksTo = " ".join(state.linksTo for state in column[start:stop] if state.linksTo)
+                for state in column[start:stop]:
+                    del self.statesList[state.name]
+                    self.bandMembers[state.name] = band.name
+                self.statesList[band.name] = band
+                kept.append(band)
+            self.columnIndex[c] = kept
+
+    def Bands(self):
+        return [state for state in self.statesList.values() if state.band is not None]
+
+    def MakeLeftRightPoints(self):
+        self.PlaceColumns()
         for state in self.statesList.values():
-            state.leftPointx = state.column*columnWidth + state.column*columnWidth/2.0
             state.leftPointy = state.energy
-            state.rightPointx = state.leftPointx + columnWidth
             state.rightPointy = state.energy
             state.labelPosition = state.energy
 
+    def PlaceColumns(self):
+        # horizontal position of every state from its column
+        columnWidth = self.columnWidth
+        columnSpacing = self.columnSpacing
+        for state in self.statesList.values():
+            state.leftPointx = state.column*columnSpacing
+            state.rightPointx = state.leftPointx + columnWidth
+
     def MaxColumnNo(self):
         # find smallest and largest column number
-        maxcol = -1
-        for _, state in self.statesList.items():
-            if state.column > maxcol:
-                maxcol = state.column
-        return maxcol
+        if len(self.columnIndex) == 0:
+            return -1
+        return max(self.columnIndex)
 
     def MinColumnNo(self):
         # find smallest and largest column number
-        mincol = 100
-        for state in self.statesList.values():
-            if state.column < mincol:
-                mincol = state.column
-        return mincol
+        if len(self.columnIndex) == 0:
+            return 100
+        return min(self.columnIndex)
+
+    def Columns(self):
+        # (column number, states) pairs in column order
+        return sorted(self.columnIndex.items(), key=lambda item: item[0])
 
     def FindPositionHelperIsCrowded(self, column):
         fontSpacing = self.fontSpacing
@@ -137,7 +872,7 @@ class Diagram:
                     column[i].labelPosition = newStart + howMuchUp
                 # make sure that labels fit into the graph
                 newTop = column[last_crowded].labelPosition + self.fontSpacing  
-                roof   = self.ax.get_ylim()[1]
+                roof   = self.ylim[1]
                 if newTop > roof:
                     stickOut = newTop - roof
                     # shift them down
@@ -149,28 +884,42 @@ class Diagram:
         return column
         
     def updatePositions(self, column):
-        # brute force
-        for i in range(len(column)):
-            name = column[i].name
-            for key, state in self.statesList.items() :
-                if state.name == name:
-                    self.statesList[key] = column[i]
-                    break
-        
-    def FindLabelPosition(self):
-        # make sure that labels don't overlap
-        maxcol = self.MaxColumnNo()
-        mincol = self.MinColumnNo()
+        for state in column:
+            self.statesList[state.name] = state
+
+    def FindLabelPosition(self, columns=None):
+        # make sure that labels don't overlap, in all columns or only the given ones
+        if self.labelSolver == "iterative":
+            self.FindLabelPositionIterative(columns)
+            return
+        if self.labelSolver != "isotonic":
+            raise ValueError("Unknown label solver: " + str(self.labelSolver))
+        spacing = self.fontSpacing * (1.0 + self.interspacing)
+        bottom, roof = self.ylim
+        for c, column in self.Columns():
+            if columns is not None and c not in columns:
+                continue
+            energies = np.fromiter((state.energy for state in column), dtype=float, count=len(column))
+            room = spacing
+            if self.bandThreshold:
+                # the energy range of a band takes two lines
+                room = np.array([2.0*spacing if state.band else spacing for state in column])
+            positions = SpreadLabels(energies, room, bottom, roof - self.fontSpacing)
+            for state, position in zip(column, positions):
+                state.labelPosition = float(position)
+            self.labelIterations[c] = 1
+
+    def FindLabelPositionIterative(self, columns=None):
+        # push crowded labels apart until nothing overlaps
         # go over each column and assing positions in each of them separately
-        for c in range(mincol, maxcol+1):    
-            column = []
-            for key, state in self.statesList.items():
-                if state.column == c:
-                    column.append(state)
-            if len(column) == 0:
+        for c, states in self.Columns():
+            if columns is not None and c not in columns:
                 continue
+            column = list(states)
+            self.labelIterations[c] = 0
             # loop over the states and push them away until you remove overlaps
             while True:
+                self.labelIterations[c] += 1
                 column, crowded = self.FindPositionHelperIsCrowded(column)
                 if not crowded:
                     self.updatePositions(column)
@@ -178,22 +927,62 @@ class Diagram:
                 # its crowded
                 column = self.ResolveCrowded(column)
 
-    def DrawCanvas(self):
-    # Positions of text are manipulated so it has to be called more than once
-        # set x lims
+    def ComputeLimits(self):
+        # axis limits straight from the state energies, as autoscaling would
+        # set them, so the layout needs no canvas draw
         maxcol = self.MaxColumnNo()
-        xleft  = -0.5*self.columnWidth
-        xright = (maxcol+2.5)*self.columnWidth
-        self.ax.set_xlim(xleft, xright)
-        self.ax.set_ylabel(str(self.energyUnits))
+        self.xlim = (-0.5*self.columnWidth, maxcol*self.columnSpacing + self.columnWidth + self.rightMargin)
+        low = min(state.band[0] if state.band else state.energy for state in self.statesList.values())
+        high = max(state.band[1] if state.band else state.energy for state in self.statesList.values())
+        if self.energyRange is not None:
+            low, high = min(low, self.energyRange[0]), max(high, self.energyRange[1])
+        if high == low:
+            low, high = low - 0.5, high + 0.5
+        margin = self.yMargin * (high - low)
+        self.ylim = (low - margin, high + margin)
+
+    def DrawCanvas(self):
+        self.ComputeLimits()
+        self.ax.set_xlim(*self.xlim)
+        self.ax.set_ylim(*self.ylim)
+        self.ax.set_ylabel(str(self.energyUnits), usetex=self.UseTex(str(self.energyUnits)))
         self.ax.set_xticks([])
-        self.fig.tight_layout()
-        self.fig.canvas.draw()
+        self.AdjustMargins()
+
+    def AdjustMargins(self):
+        # what tight_layout would do, but from font metrics instead of a draw,
+        # so the figure is only rendered once, by Save
+        figWidth, figHeight = self.fig.get_size_inches() * 72.0
+        rc = plt.rcParams
+        pad = 1.08 * self.fontSize
+        yaxis = self.ax.yaxis
+        ticks = yaxis.get_major_locator().tick_values(*self.ylim)
+        ticks = [tick for tick in ticks if self.ylim[0] <= tick <= self.ylim[1]]
+        tickLabels = yaxis.get_major_formatter().format_ticks(ticks)
+        tickWidth = 0.0
+        tickHeight = 0.0
+        for tickLabel in tickLabels:
+            width, height, _ = TextExtent(tickLabel, self.fontSize)
+            tickWidth = max(tickWidth, width)
+            tickHeight = max(tickHeight, height)
+        labelHeight = 0.0
+        if str(self.energyUnits):
+            _, labelHeight, _ = TextExtent(str(self.energyUnits), self.fontSize)
+        left = pad + labelHeight + rc['axes.labelpad'] + tickWidth \
+               + rc['ytick.major.pad'] + rc['ytick.major.size']
+        # the top and bottom tick labels stick out by half their height
+        edge = pad + 0.5 * tickHeight
+        self.fig.subplots_adjust(left = left / figWidth,
+                                 right = 1.0 - pad / figWidth,
+                                 bottom = edge / figHeight,
+                                 top = 1.0 - edge / figHeight)
 
     def DrawBars(self):
         #   Draw states' bars to indicate energy level
             # bar is only 2/7 of the state space
         for state in self.statesList.values():
+            if state.band is not None:
+                continue
             length = state.rightPointx - state.leftPointx
             left = state.leftPointx + 2.0/7.0*length
             right = state.leftPointx + 4.0/7.0*length
@@ -209,11 +998,13 @@ class Diagram:
         xoffset = length*5.0/7.0
         
         for key, state in self.statesList.items():
-            self.ax.text(state.leftPointx + xoffset, 
+            # labels mathtext cannot typeset go to LaTeX when they are drawn
+            self.ax.add_artist(FallbackText(state.leftPointx + xoffset, 
                     state.labelPosition,
                     state.label,
                     color=state.labelColor,
-                    verticalalignment='center')
+                    verticalalignment='center',
+                    clip_on=False))
 
     def DrawEnergies(self):
         #   Draw states' energies to the left from energy bars
@@ -222,7 +1013,7 @@ class Diagram:
         for state in self.statesList.values():
             self.ax.text(state.leftPointx + xoffset, 
                 state.labelPosition,
-                f"{state.energy:4.2f}",
+                self.EnergyText(state),
                 color=state.labelColor,
                 verticalalignment='center')
 
@@ -253,11 +1044,501 @@ class Diagram:
                     [energy, label + font],
                     c = col, ls = lin, lw = wid, marker = mar)
 
+    def PixelHeight(self):
+        # energy covered by one pixel of the output
+        axesHeight = self.fig.get_size_inches()[1] * self.OutputDpi() \
+                     * (self.fig.subplotpars.top - self.fig.subplotpars.bottom)
+        return (self.ylim[1] - self.ylim[0]) / axesHeight
+
+    def BarSegments(self):
+        # one segment per state, the bar is 2/7 to 4/7 of the state space
+        states = [state for state in self.statesList.values() if state.band is None]
+        if self.bandThreshold and len(states) > 0:
+            # bars closer than a pixel cannot be told apart, keep one of them
+            pixel = self.PixelHeight()
+            keys = np.array([(state.column, int(np.floor(state.energy / pixel))) for state in states])
+            _, first = np.unique(keys, axis=0, return_index=True)
+            states = [states[i] for i in np.sort(first)]
+        left = np.array([state.leftPointx for state in states], dtype=float)
+        length = np.array([state.rightPointx for state in states], dtype=float) - left
+        energy = np.array([state.energy for state in states], dtype=float)
+        segments = np.empty((len(states), 2, 2))
+        segments[:, 0, 0] = left + 2.0/7.0*length
+        segments[:, 1, 0] = left + 4.0/7.0*length
+        segments[:, 0, 1] = energy
+        segments[:, 1, 1] = energy
+        colors = [state.color or 'k' for state in states]
+        return segments, colors
+
+    def ConnectionSegments(self):
+        # two connectors for each state whose label was moved away from its energy
+        length = self.columnWidth
+        font = 0.14 * self.fontSpacing
+        states = [state for state in self.statesList.values() if state.energy != state.labelPosition]
+        left = np.array([state.leftPointx for state in states], dtype=float)
+        energy = np.array([state.energy for state in states], dtype=float)
+        label = np.array([state.labelPosition for state in states], dtype=float) + font
+        segments = np.empty((2*len(states), 2, 2))
+        segments[0::2, 0, 0] = left + length*1.1/7.0
+        segments[0::2, 0, 1] = label
+        segments[0::2, 1, 0] = left + length*1.85/7.0
+        segments[0::2, 1, 1] = energy
+        segments[1::2, 0, 0] = left + length*4.15/7.0
+        segments[1::2, 0, 1] = energy
+        segments[1::2, 1, 0] = left + length*4.85/7.0
+        segments[1::2, 1, 1] = label
+        colors = [state.color or 'k' for state in states for _ in range(2)]
+        return segments, colors
+
+    def DrawBarsCollection(self):
+        segments, colors = self.BarSegments()
+        self.barCollection = LineCollection(segments, colors=colors, linewidths=3, linestyles='-',
+                                            capstyle='projecting')
+        self.ax.add_collection(self.barCollection, autolim=False)
+
+    def DrawConnectionsCollection(self):
+        segments, colors = self.ConnectionSegments()
+        self.connectionCollection = LineCollection(segments, colors=colors, linewidths=0.5, linestyles='-')
+        self.ax.add_collection(self.connectionCollection, autolim=False)
+
+    def LinkPairs(self):
+        # (left state, right state) for every LINKSTO target, comma or space
+        # separated; merged states are linked through their band
+        pairs = {}
+        for state in self.statesList.values():
+            for target in re.split(r"[,\s]+", state.linksTo.strip()):
+                if not target:
+                    continue
+                other = self.statesList.get(self.bandMembers.get(target, target))
+                if other is None:
+                    print("WARNING: State " + state.name + " links to unknown state " + target + ".")
+                    continue
+                if other is state:
+                    continue
+                if abs(other.column - state.column) != 1:
+                    print("WARNING: Only states in adjacent columns can be linked, skipping " + state.name + " -> " + target + ".")
+                    continue
+                left, right = (state, other) if state.column < other.column else (other, state)
+                pairs[(left.name, right.name)] = (left, right)
+        return list(pairs.values())
+
+    def AxesPoints(self):
+        # width and height of the axes in points
+        figWidth, figHeight = self.fig.get_size_inches() * 72.0
+        params = self.fig.subplotpars
+        return figWidth * (params.right - params.left), figHeight * (params.top - params.bottom)
+
+    def TextSize(self, string):
+        # (width, height) of a possibly multi-line text in points
+        width = 0.0
+        height = 0.0
+        if string:
+            for line in string.split("\n"):
+                lineWidth, lineHeight = LabelExtent(line, self.fontSize)
+                width = max(width, lineWidth)
+                height += lineHeight
+        return width, height
+
+    def TextBoxes(self):
+        # boxes of the label and energy texts in data units, from font metrics
+        axesWidth, axesHeight = self.AxesPoints()
+        xScale = (self.xlim[1] - self.xlim[0]) / axesWidth
+        yScale = (self.ylim[1] - self.ylim[0]) / axesHeight
+        length = self.columnWidth
+        boxes = []
+        for state in self.statesList.values():
+            for left, string in ((state.leftPointx + length*5.0/7.0, state.label),
+                                 (state.leftPointx - length*1.75/7.0, self.EnergyText(state))):
+                if not string:
+                    continue
+                width, height = self.TextSize(string)
+                half = 0.5 * height * yScale
+                boxes.append((left, state.labelPosition - half, left + width * xScale, state.labelPosition + half))
+        return boxes
+
+    def FitColumns(self, shrink=True):
+        """
+        Widens the spacing of the columns until no label runs into an energy,
+        bar or label at the same height in any column to its right, and the
+        right margin until every label ends inside the axes. Every text is
+        measured once from the font metrics, and the obstacles of all columns
+        are filed in a grid index over (column, energy), so a label only looks
+        at what is beside it. The scale of the x axis is kept (or reduced
+        until the energies fit in front of their bars) and the figure is made
+        wider to hold the columns. With shrink=False the spacing only grows,
+        which keeps a reused figure from jumping about.
+        """
+        length = self.columnWidth
+        maxcol = self.MaxColumnNo()
+        if maxcol < 0:
+            return
+        axesWidth, axesHeight = self.AxesPoints()
+        yScale = (self.ylim[1] - self.ylim[0]) / axesHeight
+        pad = 0.25 * self.fontSize
+        # half the thickness of a bar (3 pt wide line)
+        barHalf = 1.5 * yScale
+        states = list(self.statesList.values())
+        labelSizes = [self.TextSize(state.label) for state in states]
+        energySizes = [self.TextSize(self.EnergyText(state)) for state in states]
+        textHeight = max([size[1] for size in labelSizes + energySizes] + [1.0]) * yScale
+        # obstacles, with where they start in a column (in column widths)
+        index = GridIndex(1.0, textHeight)
+        offsets = []
+        for state, (labelWidth, labelHeight), (_, energyHeight) in zip(states, labelSizes, energySizes):
+            c = state.column
+            middle = state.labelPosition
+            index.Insert((c, middle - 0.5*energyHeight*yScale, c, middle + 0.5*energyHeight*yScale))
+            offsets.append(-1.75/7.0)
+            low, high = (state.band[0], state.band[1]) if state.band else (state.energy, state.energy)
+            index.Insert((c, low - barHalf, c, high + barHalf))
+            offsets.append(2.0/7.0)
+            if labelWidth > 0.0:
+                index.Insert((c, middle - 0.5*labelHeight*yScale, c, middle + 0.5*labelHeight*yScale))
+                offsets.append(5.0/7.0)
+
+        # the energies, which start at -1.75/7, must end before the connectors
+        # begin at 1.1/7; that bounds the data units per point of the x axis
+        energyWidth = max([size[0] for size in energySizes] + [1.0])
+        perPoint = min((self.xlim[1] - self.xlim[0]) / axesWidth, 2.85/7.0 * length / (energyWidth + pad))
+
+        # a label k columns left of something at its height asks for
+        # k * spacing >= start + width, and every label must end in the axes
+        spacing = 1.5 * length if shrink else self.columnSpacing
+        ends = []
+        for state, (labelWidth, labelHeight) in zip(states, labelSizes):
+            if labelWidth == 0.0:
+                continue
+            end = 5.0/7.0 * length + (labelWidth + pad) * perPoint
+            ends.append((state.column, end))
+            if state.column == maxcol:
+                continue
+            half = 0.5 * labelHeight * yScale
+            hits = index.Query(state.column + 1, state.labelPosition - half, maxcol, state.labelPosition + half)
+            for number in hits:
+                k = index.boxes[number][0] - state.column
+                spacing = max(spacing, (end - offsets[number] * length) / k)
+        room = max([1.5 * length] + [end - (maxcol - c) * spacing for c, end in ends])
+        xRange = 0.5 * length + maxcol * spacing + room
+        if xRange < axesWidth * perPoint:
+            # the figure is wider than needed (it never shrinks), the rest
+            # goes to the right margin so the spacing does not creep up
+            room += axesWidth * perPoint - xRange
+        else:
+            # margins are fixed in points, only the axes grow
+            figWidth, figHeight = self.fig.get_size_inches()
+            self.fig.set_size_inches(figWidth + (xRange / perPoint - axesWidth) / 72.0, figHeight)
+            self.AdjustMargins()
+        self.columnSpacing = spacing
+        self.rightMargin = room - length
+        self.PlaceColumns()
+        self.ComputeLimits()
+        if self.ax is not None:
+            self.ax.set_xlim(*self.xlim)
+
+    def LinkSegments(self):
+        """
+        One polyline per link, from the right end of the left bar to the left
+        end of the right bar. A link that would cross a text is taken through
+        a free lane: across the label and energy texts at one height, found
+        with a grid index over the text boxes, so the cost grows with the
+        number of links and not with links times texts.
+        """
+        pairs = self.LinkPairs()
+        if len(pairs) == 0:
+            return [], []
+        length = self.columnWidth
+        boxes = self.TextBoxes()
+        textHeight = max([box[3] - box[1] for box in boxes] + [1e-9])
+        index = GridIndex(0.5*length, textHeight)
+        for box in boxes:
+            index.Insert(box)
+        gap = 0.2 * textHeight
+        # free heights across the texts between each pair of columns
+        lanes = {}
+        segments = []
+        colors = []
+        for left, right in pairs:
+            start = (left.leftPointx + 4.0/7.0*length, left.energy)
+            end = (right.leftPointx + 2.0/7.0*length, right.energy)
+            path = [start, end]
+            if index.SegmentHits(start, end):
+                laneLeft = left.leftPointx + 4.5/7.0*length
+                laneRight = right.leftPointx + 1.5/7.0*length
+                if left.column not in lanes:
+                    blocked = [index.boxes[number][1::2] for number in
+                               index.Query(laneLeft, self.ylim[0], laneRight, self.ylim[1])]
+                    # keep lanes off the frame of the axes
+                    lanes[left.column] = FreeIntervals(blocked, gap, self.ylim[0] + gap, self.ylim[1] - gap)
+                lane = NearestFree(*lanes[left.column], 0.5*(start[1] + end[1]))
+                if lane is not None:
+                    path = [start, (laneLeft, lane), (laneRight, lane), end]
+            segments.append(path)
+            colors.append(left.color or 'k')
+        return segments, colors
+
+    def DrawLinks(self):
+        segments, colors = self.LinkSegments()
+        self.linkCollection = LineCollection(segments, colors=colors, linewidths=0.8,
+                                             linestyles=[(0, self.dashes)])
+        self.ax.add_collection(self.linkCollection, autolim=False)
+
+    def OutputDpi(self):
+        # resolution the figure is saved at, images are reduced to it
+        dpi = plt.rcParams['savefig.dpi']
+        return self.fig.dpi if dpi == 'figure' else float(dpi)
+
+    def DrawImages(self):
+        """
+        Pictures given with IMAGE, centred on the bar and moved by
+        imageOffset (in axis units). Every file is fetched once from the
+        image cache, at the largest size any of its states needs.
+        """
+        self.imageArtists = []
+        states = [state for state in self.statesList.values() if state.image]
+        if len(states) == 0:
+            return
+        # an image drawn at zoom z covers z*dpi/72 output pixels per file pixel
+        pixelsPerPixel = self.OutputDpi() / 72.0
+        factors = {}
+        for state in states:
+            factors[state.image] = max(factors.get(state.image, 0.0), state.imageScale * pixelsPerPixel)
+        images = {path: _imageCache.Fetch(path, factor) for path, factor in factors.items()}
+        for state in states:
+            pixels, fraction = images[state.image]
+            length = state.rightPointx - state.leftPointx
+            position = (state.leftPointx + 3.0/7.0*length + state.imageOffset[0],
+                        state.energy + state.imageOffset[1])
+            artist = AnnotationBbox(OffsetImage(pixels, zoom=state.imageScale / fraction),
+                                    position, frameon=False, pad=0.0)
+            self.ax.add_artist(artist)
+            self.imageArtists.append(artist)
+
+    def EnergyText(self, state):
+        if state.band is not None:
+            # highest over lowest energy, as wide as a single energy
+            return f"{state.band[1]:4.2f}\n{state.band[0]:4.2f}"
+        return f"{state.energy:4.2f}"
+
+    def TextData(self):
+        #   Labels to the right and energies to the left of the bars, in one pass
+        length = self.columnWidth
+        states = list(self.statesList.values())
+        left = np.empty(len(states))
+        position = np.empty(len(states))
+        labels = []
+        energies = []
+        colors = []
+        for i, state in enumerate(states):
+            left[i] = state.leftPointx
+            position[i] = state.labelPosition
+            labels.append(state.label)
+            energies.append(self.EnergyText(state))
+            colors.append(state.labelColor)
+        # mathtext or LaTeX is chosen per label as it is drawn, see DrawText
+        return ((left + length*5.0/7.0, position, labels, colors),
+                (left - length*1.75/7.0, position, energies, colors))
+
+    def BandPolygons(self):
+        # shaded box over the bar space from the lowest to the highest energy
+        bands = self.Bands()
+        polygons = np.empty((len(bands), 4, 2))
+        for i, band in enumerate(bands):
+            length = band.rightPointx - band.leftPointx
+            left = band.leftPointx + 2.0/7.0*length
+            right = band.leftPointx + 4.0/7.0*length
+            low, high = band.band[0], band.band[1]
+            polygons[i] = [(left, low), (right, low), (right, high), (left, high)]
+        colors = [band.color or 'k' for band in bands]
+        return polygons, colors
+
+    def BandFaceColors(self, colors):
+        # light shade of the band colour, opaque because EPS has no transparency
+        return [0.35*np.array(to_rgb(color)) + 0.65 for color in colors]
+
+    def DrawBands(self):
+        polygons, colors = self.BandPolygons()
+        self.bandCollection = PolyCollection(polygons, facecolors=self.BandFaceColors(colors),
+                                             edgecolors=colors, linewidths=0.5)
+        self.ax.add_collection(self.bandCollection, autolim=False)
+
+    def DrawTexts(self):
+        labelData, energyData = self.TextData()
+        self.labelCollection = TextCollection(*labelData, verticalalignment='center')
+        self.energyCollection = TextCollection(*energyData, verticalalignment='center')
+        self.ax.add_artist(self.labelCollection)
+        self.ax.add_artist(self.energyCollection)
+
+    def UpdateCollections(self):
+        # push the current positions into the artists made by Draw
+        segments, colors = self.BarSegments()
+        self.barCollection.set_segments(segments)
+        self.barCollection.set_color(colors)
+        segments, colors = self.ConnectionSegments()
+        self.connectionCollection.set_segments(segments)
+        self.connectionCollection.set_color(colors)
+        labelData, energyData = self.TextData()
+        self.labelCollection.SetData(*labelData)
+        self.energyCollection.SetData(*energyData)
+        segments, colors = self.LinkSegments()
+        self.linkCollection.set_segments(segments)
+        self.linkCollection.set_color(colors)
+        for artist in self.imageArtists:
+            artist.remove()
+        self.DrawImages()
+        if self.bandThreshold:
+            polygons, colors = self.BandPolygons()
+            self.bandCollection.set_verts(polygons)
+            self.bandCollection.set_facecolor(self.BandFaceColors(colors))
+            self.bandCollection.set_edgecolor(colors)
+
+    def Fingerprint(self, *options):
+        """
+        Hash of everything read from the input that changes the image, in a
+        normalized form (states sorted by name, no output name), together
+        with any extra render options. Equal inputs give equal fingerprints.
+        """
+        states = [StateInputs(self.statesList[name]) for name in sorted(self.statesList)]
+        source = [self.width, self.height, self.fontSize, self.energyUnits,
+                  sorted(self.COLORS.items()), states, list(options)]
+        return hashlib.sha256(json.dumps(source, default=str).encode('utf-8')).hexdigest()
+
+    def SameLayout(self, other):
+        # True when other can be drawn into this figure by Update
+        return (self.fig is not None and self.useCollections
+                and (self.width, self.height, self.fontSize, self.OutputNames(), self.energyUnits, self.renderMode)
+                == (other.width, other.height, other.fontSize, other.OutputNames(), other.energyUnits, other.renderMode))
+
+    def Update(self, other):
+        """
+        Takes over the states of other (the same input read again) while
+        keeping this figure and its artists. Labels are laid out again only
+        in the columns whose states changed, or everywhere when the axis
+        limits moved. Returns the set of columns that were laid out.
+        """
+        other.columnSpacing = self.columnSpacing
+        other.rightMargin = self.rightMargin
+        other.MakeLeftRightPoints()
+        changed = set()
+        for name, state in other.statesList.items():
+            previous = self.statesList.get(name)
+            if previous is None or StateInputs(previous) != StateInputs(state):
+                changed.add(state.column)
+                if previous is not None:
+                    changed.add(previous.column)
+            else:
+                state.labelPosition = previous.labelPosition
+        for name, state in self.statesList.items():
+            if name not in other.statesList:
+                changed.add(state.column)
+        # states that joined, left or switched a band change its column
+        for member in set(self.bandMembers) | set(other.bandMembers):
+            before, after = self.bandMembers.get(member), other.bandMembers.get(member)
+            if before != after:
+                for states, band in ((self.statesList, before), (other.statesList, after)):
+                    if band in states:
+                        changed.add(states[band].column)
+        self.statesList = other.statesList
+        self.columnIndex = other.columnIndex
+        self.bandMembers = other.bandMembers
+        self.columns = other.columns
+        self.COLORS = other.COLORS
+        self.do_legend = other.do_legend
+
+        limits = (self.xlim, self.ylim)
+        self.ComputeLimits()
+        if (self.xlim, self.ylim) != limits:
+            self.ax.set_xlim(*self.xlim)
+            self.ax.set_ylim(*self.ylim)
+            self.AdjustMargins()
+            changed = set(self.columnIndex)
+        changed &= set(self.columnIndex)
+        if changed:
+            self.FindLabelPosition(changed)
+            self.FitColumns(shrink=False)
+            self.UpdateCollections()
+        return changed
+
+    def Stage(self, name, function, *args):
+        # run one pipeline step, timed when a profiler is attached
+        if self.profiler is None:
+            return function(*args)
+        return self.profiler.Time(name, function, *args)
+
+    def Draw(self):
+        # the whole drawing pipeline, from positions to the finished axes
+        self.Stage("MakeFigure", self.MakeFigure)
+        self.Stage("MakeLeftRightPoints", self.MakeLeftRightPoints)
+        # limits and margins first, the level of detail depends on them
+        self.Stage("DrawCanvas", self.DrawCanvas)
+        self.Stage("FindLabelPosition", self.FindLabelPosition)
+        # labels are placed, make room for their width
+        self.Stage("FitColumns", self.FitColumns)
+        if self.useCollections:
+            self.Stage("DrawBars", self.DrawBarsCollection)
+        else:
+            self.Stage("DrawBars", self.DrawBars)
+        if self.bandThreshold:
+            self.Stage("DrawBands", self.DrawBands)
+        if self.useCollections:
+            self.Stage("DrawTexts", self.DrawTexts)
+            self.Stage("DrawConnections", self.DrawConnectionsCollection)
+        else:
+            self.Stage("DrawLabels", self.DrawLabels)
+            self.Stage("DrawEnergies", self.DrawEnergies)
+            self.Stage("DrawConnections", self.DrawConnections)
+        self.Stage("DrawLinks", self.DrawLinks)
+        self.Stage("DrawImages", self.DrawImages)
+
+    def OutputNames(self):
+        # one file per requested format, named after the output file
+        if not self.formats:
+            return [self.outputName]
+        stem, extension = os.path.splitext(self.outputName)
+        if extension.lower() not in OUTPUT_FORMATS:
+            stem = self.outputName
+        return [stem + "." + fmt for fmt in self.formats]
+
+    def RenderBytes(self, format='png', dpi=None):
+        # the figure rendered into memory, nothing is written to disk
+        buffer = io.BytesIO()
+        self.fig.savefig(buffer, format=format, dpi=dpi)
+        return buffer.getvalue()
+
     def Save(self):
-        self.fig.savefig(fname = "singlets.eps", 
-                         format = 'eps')
+        """
+        Writes the figure in every requested format (or the format given by
+        the extension of the output file). The laid out figure is rendered
+        once per format; matplotlib cannot draw one figure from several
+        threads, so only the file writes run concurrently.
+        """
+        names = self.OutputNames()
+        if len(names) == 1:
+            self.fig.savefig(fname = names[0])
+            return names
+        rendered = [(name, self.RenderBytes(os.path.splitext(name)[1][1:])) for name in names]
+        with concurrent.futures.ThreadPoolExecutor(len(rendered)) as pool:
+            list(pool.map(lambda item: WriteBytes(*item), rendered))
+        return names
+
+def WriteBytes(filename, data):
+    with open(filename, 'wb') as out:
+        out.write(data)
+
+# State attributes that come from the input file
+STATE_INPUTS = ('name', 'color', 'labelColor', 'linksTo', 'label', 'legend', 'energy',
+                'column', 'labelOffset', 'textOffset', 'image', 'imageOffset', 'imageScale', 'band')
+
+def StateInputs(state):
+    return tuple(getattr(state, attribute) for attribute in STATE_INPUTS)
 
 class State:
+    # many thousands of states are common, keep them small
+    __slots__ = ('name', 'color', 'labelColor', 'linksTo', 'label', 'legend',
+                 'energy', 'normalisedPosition', 'column', 'leftPointx',
+                 'leftPointy', 'rightPointx', 'rightPointy', 'isCrowded',
+                 'labelPosition', 'labelOffset', 'textOffset', 'imageOffset',
+                 'imageScale', 'image', 'band')
+
     def __init__(self):
         self.name        = ""
         self.color       = ""
@@ -279,204 +1560,835 @@ class State:
         self.imageOffset = (0,0)
         self.imageScale  = 1.0
         self.image = None
+        # (lowest energy, highest energy, number of states) for a band made by MakeBands
+        self.band = None
+
+    # plain tuples pickle much faster than the default slot dictionaries
+    def __getstate__(self):
+        return tuple([getattr(self, attribute) for attribute in self.__slots__])
+
+    def __setstate__(self, values):
+        for attribute, value in zip(self.__slots__, values):
+            setattr(self, attribute, value)
 
 ######################################################################################################
 #           Input reading block
 ######################################################################################################
 
+class InputError(ValueError):
+    """
+    Raised once an input file is read to the end, with every problem found
+    in .errors as (line number, message) pairs.
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        ValueError.__init__(self, "; ".join("line {:}: {:}".format(lc, message) if lc else message
+                                            for lc, message in errors))
+
+def _Pair(value):
+    tx, ty = value.split(',')
+    return (float(tx), float(ty))
+
+def _Column(value):
+    return int(value) - 1
+
+def _ImageScale(value):
+    scale = float(value)
+    if scale < 0.1:
+        print("image scale cannot be < 0.1, setting to 0.1/")
+    return max(scale, 0.1)
+
+def _ImagePath(value):
+    # only the path is kept, the image is read when it is drawn
+    if not os.path.isfile(value):
+        raise ValueError("Failed to find image " + value)
+    return value
+
+def _Upper(value):
+    return value.upper()
+
+def _OutputName(value):
+    if not value.lower().endswith(OUTPUT_FORMATS):
+        print("WARNING: Output will be .pdf. Adding this to output file.\nFile will be saved as "+value + ".pdf")
+        return value + ".pdf"
+    return value
+
+# keys are matched upper-cased with blanks, '-' and '_' taken out, so
+# 'text colour', 'Text-Colour' and 'TEXTCOLOUR' are all the same key
+# key -> (attribute, converter, what to say when the value is no good)
+STATE_KEYS = {
+    "NAME":        ('name', _Upper, None),
+    "TEXTCOLOR":   ('color', _Upper, None),
+    "TEXTCOLOUR":  ('color', _Upper, None),
+    "LABEL":       ('label', str, None),
+    "LABELCOLOR":  ('labelColor', str, None),
+    "LABELCOLOUR": ('labelColor', str, None),
+    "LINKSTO":     ('linksTo', _Upper, None),
+    "COLUMN":      ('column', _Column, "integer for column number"),
+    "ENERGY":      ('energy', float, "real number for energy"),
+    "LABELOFFSET": ('labelOffset', _Pair, "real number for label offset"),
+    "TEXTOFFSET":  ('textOffset', _Pair, "real number for text offset"),
+    "LEGEND":      ('legend', str, None),
+    "IMAGE":       ('image', _ImagePath, "image"),
+    "IMAGEOFFSET": ('imageOffset', _Pair, "real number for image offset"),
+    "IMAGESCALE":  ('imageScale', _ImageScale, "real number for image scale"),
+}
+
+GLOBAL_KEYS = {
+    "WIDTH":       ('width', int, "integer for diagram width"),
+    "HEIGHT":      ('height', int, "integer for diagram height"),
+    "OUTPUT":      ('outputName', _OutputName, None),
+    "OUTPUTFILE":  ('outputName', _OutputName, None),
+    "ENERGYUNITS": ('energyUnits', str, None),
+    "FONTSIZE":    ('fontSize', int, "integer for font size"),
+}
+
+def _Key(text):
+    return "".join(text.upper().split()).replace("-", "").replace("_", "")
+
+def IterInput(inp, settings, errors):
+    """
+    Reads lines of an input file in a single pass and yields every State
+    as soon as its closing '}' is read. Global settings are stored in the
+    settings dict as they turn up; problems are appended to errors as
+    (line number, message) pairs and reading goes on. Yields (line number
+    of the opening '{', state) pairs.
+    """
+    state = None
+    start = 0
+    globalSeen = {}
+    stateSeen = {}
+    for lc, line in enumerate(inp, 1):
+        line = line.strip()
+        if len(line) == 0 or line[0] == "#":
+            continue
+        first = line[0]
+        if first == "{":
+            if state is not None:
+                print("Unexpected opening '{' within state block on line " + str(lc) + ".\nPossible forgotten closing '}'.")
+                errors.append((lc, "Unexpected {"))
+                yield start, state
+            state = State()
+            start = lc
+            continue
+        if first == "}":
+            if state is None:
+                print("WARNING: Not expecting closing } on line: " + str(lc))
+            else:
+                yield start, state
+                state = None
+            continue
+        key, equals, value = line.partition('=')
+        # the same few spellings come back on every state, look each up once
+        seen = globalSeen if state is None else stateSeen
+        entry = seen.get(key, False)
+        if entry is False:
+            entry = (GLOBAL_KEYS if state is None else STATE_KEYS).get(_Key(key))
+            seen[key] = entry
+        if not equals:
+            entry = None
+        if entry is None:
+            print("Ignoring unrecognised line " + str(lc) + ":\n\t"+line)
+            continue
+        attribute, convert, what = entry
+        try:
+            value = convert(value.strip())
+        except ValueError as err:
+            message = "Could not read " + what if what else str(err)
+            print("ERROR: " + message + " on line " + str(lc) + ":\n\t" + line)
+            errors.append((lc, message))
+            continue
+        if state is None:
+            settings[attribute] = value
+        else:
+            setattr(state, attribute, value)
+    if state is not None:
+        print("WARNING: Final closing '}' is missing.")
+        yield start, state
+
 def ReadInput(filename):
     try:
         inp = open(filename,'r')
     except:
         print("Error opening file. File: " + filename + " may not exist.")
         raise SystemExit("Could not open Input file: {:}".format(filename))
+    with inp:
+        return ParseInput(inp)
 
-    stateBlock = False
-    statesList = []
-    width = 0
-    height = 0
-    fontSize = 8
-    energyUnits = ""
-    colorsToAdd = {}
-    lc = 0
-    for line in inp:
-        lc += 1
-        line = line.strip()
-        if (len(line) > 0 and line.strip()[0] != "#"):
-            if (stateBlock):
-                if (line.strip()[0] == "{"):
-                    print("Unexpected opening '{' within state block on line " + str(lc) + ".\nPossible forgotten closing '}'.")
-                    raise ValueError("ERROR: Unexpected { on line " + str(lc))
-                if (line.strip()[0] == "}"):
-                    stateBlock = False
-                else:
-                    raw = line.split('=')
-                    if (len(raw) != 2 and raw[0].upper().strip() != "LABEL"):
-                        print(raw[0].strip())
-                        print("Ignoring unrecognised line " + str(lc) + ":\n\t"+line)
-                    else:
-                        raw[0] = raw[0].upper().strip()
-                        raw[1] = raw[1].strip()
-                        if (raw[0] == "NAME"):
-                            statesList[-1].name = raw[1].upper()
-                        elif (raw[0] == "TEXTCOLOR" or raw[0] == "TEXTCOLOUR" or raw[0] == "TEXT-COLOUR" or raw[0] == "TEXT-COLOR" or raw[0] == "TEXT COLOUR" or raw[0] == "TEXT COLOR"):
-                            statesList[-1].color = raw[1].upper()
-                        elif (raw[0] == "LABEL"):
-                            statesList[-1].label = ""
-                            for i in range(1, len(raw)):
-                                statesList[-1].label += raw[i]
-                                if i < len(raw)-1:
-                                    statesList[-1].label += " = "
-                        elif (raw[0] == "LABELCOLOR" or raw[0] == "LABELCOLOUR"):
-                            statesList[-1].labelColor = raw[1]
-                        elif (raw[0] == "LINKSTO" or raw[0] == "LINKS TO"):
-                            statesList[-1].linksTo = raw[1].upper()
-                        elif (raw[0] == "COLUMN"):
-                            try:
-                                statesList[-1].column = int(raw[1])-1
-                            except ValueError:
-                                print("ERROR: Could not read integer for column number on line " + str(lc)+ ":\n\t"+line)
-                        elif (raw[0] == "ENERGY"):
-                            try:
-                                statesList[-1].energy = float(raw[-1])
-                            except ValueError:
-                                print("ERROR: Could not read real number for energy on line " + str(lc)+ ":\n\t"+line)
-                        elif (raw[0] == "LABELOFFSET" or raw[0] == "LABEL OFFSET" or raw[0] == "LABEL-OFFSET"):
-                            raw[1] = raw[1].split(',')
-                            try:
-                                tx = float(raw[1][0])
-                                ty = float(raw[1][1])
-                                statesList[-1].labelOffset = (tx, ty)
-                            except ValueError:
-                                print("ERROR: Could not read real number for label offset on line " + str(lc)+ ":\n\t"+line)
-                        elif (raw[0] == "TEXTOFFSET" or raw[0] == "TEXT OFFSET" or raw[0] == "TEXT-OFFSET"):
-                            raw[1] = raw[1].split(',')
-                            try:
-                                tx = float(raw[1][0])
-                                ty = float(raw[1][1])
-                                statesList[-1].textOffset = (tx, ty)
-                            except ValueError:
-                                print("ERROR: Could not read real number for text offset on line " + str(lc)+ ":\n\t"+line)
-                        elif raw[0] == "LEGEND":
-                            statesList[-1].legend = raw[1]
-                        elif raw[0] == "IMAGE":
-                            try:
-                                statesList[-1].image = plt.imread(raw[-1])
-                            except IOError:
-                                raise IOError("Failed to find image on line {:}".format(lc))
-                        elif "IMAGE" in raw[0] and "OFFSET" in raw[0]:
-                            raw[1] = raw[1].split(',')
-                            try:
-                                tx = float(raw[1][0])
-                                ty = float(raw[1][1])
-                                statesList[-1].imageOffset = (tx, ty)
-                            except ValueError:
-                                print("ERROR: Could not read real number for image offset on line " + str(lc)+ ":\n\t"+line)
-                        elif "IMAGE" in raw[0] and "SCALE" in raw[0]:
-                            try:
-                                scale = float(raw[1])
-                                if scale < 0.1:
-                                    print("image scale cannot be < 0.1, setting to 0.1/")
-                                statesList[-1].imageScale = max(scale, 0.1)
-                            except ValueError:
-                                print("ERROR: Could not read real number for image scale on line " + str(lc)+ ":\n\t"+line)
-                        else:
-                            print("Ignoring unrecognised line " + str(lc) + ":\n\t"+line)
-            elif (line.strip()[0] == "{"):
-                statesList.append(State())
-                stateBlock = True   # we have entered a state block
-
-            elif (line.strip()[0] == "}"):
-                print("WARNING: Not expecting closing } on line: " + str(lc))
-
-            else:
-                raw = line.split('=')
-                if (len(raw) != 2):
-                    print("Ignoring unrecognised line " + str(lc) + ":\n\t"+line)
-                else:
-                    raw[0] = raw[0].upper().strip()
-                    raw[1] = raw[1].strip().lstrip()
-                    if (raw[0] == "WIDTH"):
-                        try:
-                            width = int(raw[1])
-                        except ValueError:
-                            print("ERROR: Could not read integer for diagram width on line " + str(lc)+ ":\n\t"+line)
-                    elif (raw[0] == "HEIGHT"):
-                        try:
-                            height = int(raw[1])
-                        except ValueError:
-                            print("ERROR: Could not read integer for diagram height on line " + str(lc)+ ":\n\t"+line)
-                    elif (raw[0] == "OUTPUT-FILE" or raw[0] == "OUTPUT"):
-                        raw[1] = raw[1].lstrip()
-                        if ( not raw[1].endswith('.pdf')):
-                            print("WARNING: Output will be .pdf. Adding this to output file.\nFile will be saved as "+raw[1] + ".pdf")
-                            outName = raw[1] + ".pdf"
-                        else:
-                            outName = raw[1]
-                    elif (raw[0] == "ENERGY-UNITS" or raw[0] == "ENERGYUNITS" or raw[0] == "ENERGY UNITS"):
-                        energyUnits = raw[1]
-                    elif (raw[0] == "FONT-SIZE" or raw[0] == "FONTSIZE" or raw[0] == "FONT SIZE"):
-                        try:
-                            fontSize = int(raw[1])
-                            plt.rcParams.update({'font.size': fontSize})
-                        except ValueError:
-                            print("ERROR: Could not read integer for font size on line " + str(lc)+ ":\n\t"+line)
-                            print("Default will be used...")
-                    else:
-                        print("WARNING: Skipping unknown line " + str(lc) + ":\n\t" + line)
-    if (stateBlock):
-        print("WARNING: Final closing '}' is missing.")
-    if (height == 0):
-        print("ERROR: Image height not set! e.g.:\nheight = 500")
-        raise ValueError("Height not set")
-    if (width == 0):
-        print("ERROR: Image width not set! e.g.:\nwidth = 500")
-        raise ValueError("Width not set")
-    if (outName == ""):
-        print("ERROR: output file name not set! e.g.:\n output-file = example.pdf")
-        raise ValueError("Output name not set")
-
-    outDiagram = Diagram(width, height, fontSize, outName)
-    outDiagram.energyUnits = energyUnits
-    for color in colorsToAdd:
-        outDiagram.COLORS[color] = colorsToAdd[color]
+def ParseInput(inp, outputName=None):
+    """
+    Builds a Diagram from the lines of an input file. inp is any iterable
+    of lines: an open file, io.StringIO, a list... outputName is used when
+    the input has no output-file line. All problems are reported together
+    in one InputError.
+    """
+    settings = {'width': 0, 'height': 0, 'fontSize': 8, 'energyUnits': "", 'outputName': outputName}
+    errors = []
+    outDiagram = Diagram(0, 0, 8, outputName)
     maxColumn = 0
-    for state in statesList:
+    for lc, state in IterInput(inp, settings, errors):
+        if state.name in outDiagram.statesList:
+            print("ERROR: States must have unique names. State " + state.name + " is already in use!")
+            errors.append((lc, "State " + state.name + " is defined twice"))
+            continue
         outDiagram.AddState(state)
         if (state.column > maxColumn):
             maxColumn = state.column
+    if (settings['height'] == 0):
+        print("ERROR: Image height not set! e.g.:\nheight = 500")
+        errors.append((None, "Height not set"))
+    if (settings['width'] == 0):
+        print("ERROR: Image width not set! e.g.:\nwidth = 500")
+        errors.append((None, "Width not set"))
+    if not settings['outputName']:
+        print("ERROR: output file name not set! e.g.:\n output-file = example.pdf")
+        errors.append((None, "Output name not set"))
+    if errors:
+        raise InputError(errors)
+
+    for attribute, value in settings.items():
+        setattr(outDiagram, attribute, value)
     outDiagram.columns = maxColumn + 1
 
     return outDiagram
 
+######################################################################################################
+#           Bulk input from arrays and tables
+######################################################################################################
+
+# extensions read by ReadTable instead of the input file parser
+TABLE_FORMATS = ('.csv', '.npy', '.npz')
+
+def _Strings(values):
+    # text fields as str; 'S' arrays and bytes (common in .npy files) are decoded
+    array = np.asarray(values)
+    if array.dtype.kind == 'S':
+        array = np.char.decode(array, 'utf-8')
+    return [value.decode('utf-8') if isinstance(value, bytes) else str(value) for value in array.tolist()]
+
+def DiagramFromArrays(names, energies, columns, labels=None, colors=None, labelColors=None,
+                      width=8, height=8, fontSize=8, outputName="diagram.pdf", energyUnits=""):
+    """
+    Builds a Diagram straight from arrays, one entry per state, without
+    going through an input file. Columns count from 1 as in input files.
+    Missing labels are left empty, missing label colours follow the state
+    colour and missing colours are black.
+    """
+    energies = np.asarray(energies, dtype=float)
+    count = len(energies)
+    if count == 0:
+        print("ERROR: No states given, a diagram needs at least one.")
+        raise ValueError("No states.")
+    columns = np.asarray(columns, dtype=float)
+    if np.any(columns != np.round(columns)):
+        print("ERROR: Column numbers must be whole numbers.")
+        raise ValueError("Column numbers that are not integers.")
+    columns = columns.astype(int) - 1
+    names = [name.upper() for name in _Strings(names)]
+    if len(names) != count or len(columns) != count:
+        raise ValueError("names, energies and columns must have the same length")
+    if len(set(names)) != count:
+        seen = set()
+        for name in names:
+            if name in seen:
+                print("ERROR: States must have unique names. State " + name + " is already in use!")
+                break
+            seen.add(name)
+        raise ValueError("Non unique state names.")
+    labels = [""] * count if labels is None else _Strings(labels)
+    colors = ["BLACK"] * count if colors is None else [color.upper() for color in _Strings(colors)]
+    if labelColors is None:
+        labelColors = colors
+    else:
+        labelColors = [color.upper() for color in _Strings(labelColors)]
+
+    diagram = Diagram(width, height, fontSize, outputName)
+    diagram.energyUnits = energyUnits
+    statesList = diagram.statesList
+    columnIndex = diagram.columnIndex
+    # names are checked and upper-cased already, so skip AddState
+    for name, energy, column, label, color, labelColor in zip(names, energies.tolist(), columns.tolist(),
+                                                            labels, colors, labelColors):
+        state = State()
+        state.name = name
+        state.energy = energy
+        state.column = column
+        state.label = label
+        state.color = color
+        state.labelColor = labelColor
+        statesList[name] = state
+        columnIndex.setdefault(column, []).append(state)
+    diagram.columns = int(columns.max()) + 1
+    return diagram
+
+def _TableField(table, names, required=True):
+    # first of the accepted spellings present in the table
+    for name in names:
+        if name in table:
+            return table[name]
+    if required:
+        raise ValueError("Table has no '{:}' column".format(names[0]))
+    return None
+
+def ReadTable(filename, **diagramOptions):
+    """
+    Reads states from a table with the columns name, energy, column and
+    optionally label, colour and label colour:
+      .csv  a header line with those names, then one state per row
+      .npy  a structured array with those fields (memory-mapped)
+      .npz  one array per field
+    Keyword options go to DiagramFromArrays; the output file defaults to
+    the table name with a .pdf extension.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == ".npy":
+        array = np.load(filename, mmap_mode='r')
+        table = {field.lower(): array[field] for field in array.dtype.names or ()}
+    elif extension == ".npz":
+        with np.load(filename) as archive:
+            table = {key.lower(): archive[key] for key in archive.files}
+    elif extension == ".csv":
+        with open(filename, newline='') as inp:
+            reader = csv.reader(inp, skipinitialspace=True)
+            header = [field.strip().lower() for field in next(reader)]
+            fields = list(zip(*([value.strip() for value in row] for row in reader if row)))
+        if len(fields) == 0:
+            fields = [()] * len(header)
+        table = dict(zip(header, fields))
+    else:
+        raise ValueError("Unknown table format: " + filename)
+
+    diagramOptions.setdefault("outputName", os.path.splitext(filename)[0] + ".pdf")
+    return DiagramFromArrays(_TableField(table, ["name"]),
+                             np.asarray(_TableField(table, ["energy"]), dtype=float),
+                             np.asarray(_TableField(table, ["column"]), dtype=float),
+                             labels=_TableField(table, ["label"], False),
+                             colors=_TableField(table, ["colour", "color", "text-colour", "text-color"], False),
+                             labelColors=_TableField(table, ["labelcolour", "labelcolor"], False),
+                             **diagramOptions)
+
+
+######################################################################################################
+#           Rendering drivers
+######################################################################################################
+
+class ParsedCache:
+    """
+    Diagrams as they come out of the input reader, keyed by the input path,
+    modification time and size, so an unchanged input is never parsed twice.
+    Entries are kept pickled in memory (the maxEntries most recently used)
+    and, when a directory is given, on disk for other processes and runs.
+    """
+    # bump when the meaning of a stored value changes; added or removed
+    # attributes are caught by the layout in the key
+    VERSION = 1
+
+    def __init__(self, directory=None, maxEntries=64):
+        self.directory = directory
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        # key -> pickled diagram, oldest first
+        self.memory = {}
+        # States pickle as tuples in slot order, so an entry written with
+        # other slots would load values into the wrong attributes
+        self.layout = hashlib.sha256(repr((State.__slots__, sorted(vars(Diagram(0, 0, 8, None)))))
+                                     .encode('utf-8')).hexdigest()
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def Key(self, filename):
+        info = os.stat(filename)
+        return (self.VERSION, os.path.abspath(filename), info.st_mtime_ns, info.st_size, self.layout)
+
+    def Fetch(self, filename, read):
+        try:
+            key = self.Key(filename)
+        except OSError:
+            # let the reader report the missing file
+            return read(filename)
+        data = self.memory.pop(key, None)
+        if data is None:
+            data = self._Load(key)
+        if data is not None:
+            self.hits += 1
+            self._Remember(key, data)
+            return pickle.loads(data)
+        self.misses += 1
+        diagram = read(filename)
+        data = pickle.dumps(diagram, pickle.HIGHEST_PROTOCOL)
+        self._Remember(key, data)
+        self._Store(key, data)
+        return diagram
+
+    def _Remember(self, key, data):
+        self.memory[key] = data
+        while len(self.memory) > self.maxEntries:
+            del self.memory[next(iter(self.memory))]
+
+    def _Path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key[1].encode('utf-8')).hexdigest() + ".pickle")
+
+    def _Load(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self._Path(key), 'rb') as inp:
+                stamp, data = pickle.load(inp)
+        except Exception:
+            # missing, half written or from an older version
+            return None
+        return data if stamp == key else None
+
+    def _Store(self, key, data):
+        if self.directory is None:
+            return
+        # write next to the target and rename, other processes may read it already
+        fd, tmp = tempfile.mkstemp(suffix=".pickle", dir=self.directory)
+        with os.fdopen(fd, 'wb') as out:
+            pickle.dump((key, data), out, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._Path(key))
+
+# the cache used by this process, see UseParsedCache
+_parsedCache = None
+
+def UseParsedCache(directory=None, maxEntries=64):
+    global _parsedCache
+    if _parsedCache is None or _parsedCache.directory != directory:
+        _parsedCache = ParsedCache(directory, maxEntries)
+    _parsedCache.maxEntries = maxEntries
+    return _parsedCache
+
+def _ReadUncached(filename):
+    # tables of states go to ReadTable, everything else is an input file
+    if filename.lower().endswith(TABLE_FORMATS):
+        return ReadTable(filename)
+    return ReadInput(filename)
+
+def ReadAny(filename):
+    if _parsedCache is not None:
+        return _parsedCache.Fetch(filename, _ReadUncached)
+    return _ReadUncached(filename)
+
+def LoadDiagram(filename, labelSolver="isotonic", useCollections=True, renderMode="usetex",
+                labelCacheDir=None, labelCacheSize=64*1024*1024, formats=None, bandThreshold=None,
+                parseCacheDir=None, profiler=None):
+    # read an input file and apply the rendering options, nothing is drawn yet
+    if labelCacheDir is not None:
+        UseLabelCache(labelCacheDir, labelCacheSize)
+    if parseCacheDir is not None:
+        UseParsedCache(parseCacheDir)
+    if profiler is not None:
+        diagram = profiler.Time("ReadInput", ReadAny, filename)
+    else:
+        diagram = ReadAny(filename)
+    diagram.profiler = profiler
+    diagram.labelSolver = labelSolver
+    diagram.useCollections = useCollections
+    diagram.renderMode = renderMode
+    diagram.formats = formats
+    diagram.bandThreshold = bandThreshold
+    diagram.Stage("MakeBands", diagram.MakeBands)
+    return diagram
+
+def RenderFile(filename, profiler=None, **options):
+    # full pipeline for one input file, returns the finished diagram
+    diagram = None
+    if profiler is not None:
+        profiler.Start()
+    try:
+        if profiler is not None:
+            # import cost is its own stage, otherwise it lands in ReadInput
+            profiler.Time("ImportMatplotlib", ImportMatplotlib)
+        diagram = LoadDiagram(filename, profiler=profiler, **options)
+        diagram.Draw()
+        diagram.Stage("Save", diagram.Save)
+    finally:
+        if profiler is not None:
+            profiler.Finish(diagram)
+        # keep memory flat when many diagrams are made in one process
+        if diagram is not None and diagram.fig is not None:
+            plt.close(diagram.fig)
+    return diagram
+
+def RenderToBytes(filename, format='png', dpi=None, **options):
+    """
+    Renders an input file straight into memory and returns the image bytes
+    in the given format, for callers that stream figures instead of saving.
+    """
+    diagram = LoadDiagram(filename, **options)
+    try:
+        diagram.Draw()
+        return diagram.RenderBytes(format, dpi)
+    finally:
+        if diagram.fig is not None:
+            plt.close(diagram.fig)
+
+def ProfileFile(filename, cprofileOutput=None, **options):
+    """
+    Renders filename like RenderFile and returns the profile report: wall
+    and CPU time per stage, label solver passes per column, artist count,
+    canvas draws and, when the label cache is in use, time spent in LaTeX.
+    """
+    profiler = Profiler(cprofileOutput)
+    RenderFile(filename, profiler=profiler, **options)
+    report = profiler.Report()
+    report["input"] = filename
+    return report
+
+def CheckFile(filename, labelSolver="isotonic", bandThreshold=None, parseCacheDir=None, **options):
+    """
+    Reads an input file and runs the label layout without drawing anything
+    (matplotlib is not even imported). Returns the laid out diagram; input
+    errors raise as they would in a real run.
+    """
+    if parseCacheDir is not None:
+        UseParsedCache(parseCacheDir)
+    diagram = ReadAny(filename)
+    diagram.labelSolver = labelSolver
+    diagram.bandThreshold = bandThreshold
+    diagram.MakeBands()
+    diagram.MakeLeftRightPoints()
+    diagram.ComputeLimits()
+    diagram.FindLabelPosition()
+    return diagram
+
+def PrintLabelPositions(diagram):
+    for c, column in diagram.Columns():
+        print("  column {:}".format(c+1))
+        for state in sorted(column, key=getEnergy):
+            print("    {:<16} energy {: 10.4f}   label at {: 10.4f}".format(state.name, state.energy, state.labelPosition))
+
+def WatchFile(filename, interval=0.2, **options):
+    """
+    Renders filename and then again every time it changes, until interrupted.
+    The Diagram and its figure stay alive between edits; when only states
+    changed, just their columns are laid out again before saving.
+    """
+    diagram = None
+    stamp = None
+    try:
+        while True:
+            try:
+                info = os.stat(filename)
+                current = (info.st_mtime_ns, info.st_size)
+            except OSError:
+                current = None
+            if current is None or current == stamp:
+                time.sleep(interval)
+                continue
+            stamp = current
+            start = time.time()
+            try:
+                fresh = LoadDiagram(filename, **options)
+                if diagram is not None and diagram.SameLayout(fresh):
+                    changed = diagram.Update(fresh)
+                    what = "{:} column(s) laid out again".format(len(changed))
+                else:
+                    if diagram is not None:
+                        plt.close(diagram.fig)
+                    diagram = fresh
+                    diagram.Draw()
+                    what = "full render"
+                diagram.Save()
+            except (Exception, SystemExit) as err:
+                print("ERROR: {:}: {:}".format(type(err).__name__, err))
+                print("Waiting for the next change of " + filename)
+                continue
+            print("Image {:} updated in {:.3f} s ({:})".format(", ".join(diagram.OutputNames()), time.time() - start, what))
+    except KeyboardInterrupt:
+        print("\nStopped watching " + filename)
+    finally:
+        if diagram is not None and diagram.fig is not None:
+            plt.close(diagram.fig)
+
+def FrameNames(output, count):
+    # output%number when output has a pattern, else output_0000.png and so on
+    if "%" in output:
+        return [output % number for number in range(count)]
+    stem, extension = os.path.splitext(output)
+    return ["{:}_{:04d}{:}".format(stem, number, extension) for number in range(count)]
+
+def RenderSequence(filenames, output, fps=2, **options):
+    """
+    Renders a series of inputs with the same states, e.g. one per point of
+    a scan along a reaction coordinate, as the frames of one animation.
+    The figure and its artists are made once, from the first input; each
+    later frame only updates the data that changed and lays out again the
+    columns whose states changed. The energy axis covers all frames. A .gif
+    output is written as an animation, anything else as numbered frames.
+    Returns the names of the files written.
+    """
+    if len(filenames) == 0:
+        raise ValueError("A sequence needs at least one input.")
+    if not options.get("useCollections", True):
+        raise ValueError("Sequences are drawn with collections only.")
+    animated = output.lower().endswith(".gif")
+    if not animated and not output.lower().endswith(OUTPUT_FORMATS):
+        print("Unknown output format: " + output)
+        raise ValueError("Incorrect Arguments.")
+    frames = [LoadDiagram(filename, **options) for filename in filenames]
+    energies = [state.energy for frame in frames for state in frame.statesList.values()]
+    energyRange = (min(energies), max(energies))
+    for frame in frames:
+        frame.energyRange = energyRange
+    names = [output] if animated else FrameNames(output, len(frames))
+    # a gif has one frame size: every frame is laid out once before any is
+    # grabbed, so the figure is as wide as the widest frame needs
+    passes = [copy.deepcopy(frames), frames] if animated and len(frames) > 1 else [frames]
+    diagram = None
+    writer = None
+    try:
+        for sequence in passes:
+            grab = sequence is frames
+            for number, (filename, fresh) in enumerate(zip(filenames, sequence)):
+                if diagram is None:
+                    diagram = fresh
+                    diagram.Draw()
+                else:
+                    # the frame is saved under the sequence's name, not its own
+                    fresh.outputName = diagram.outputName
+                    fresh.formats = diagram.formats
+                    if not diagram.SameLayout(fresh):
+                        raise ValueError("Frame " + filename + " differs in size, font or units from the first frame.")
+                    diagram.Update(fresh)
+                if not grab:
+                    continue
+                if animated:
+                    if writer is None:
+                        from matplotlib.animation import PillowWriter
+                        writer = PillowWriter(fps=fps)
+                        writer.setup(diagram.fig, output, dpi=diagram.OutputDpi())
+                    writer.grab_frame()
+                else:
+                    diagram.fig.savefig(names[number])
+        if animated:
+            writer.finish()
+    finally:
+        if diagram is not None and diagram.fig is not None:
+            plt.close(diagram.fig)
+    return names
+
+def _WarmWorker():
+    # pay for the matplotlib start up once per worker, not once per file
+    ImportMatplotlib()
+    plt.figure()
+    plt.close('all')
+
+def _BatchJob(filename, options):
+    options = dict(options)
+    profiler = Profiler() if options.pop("profile", False) else None
+    start = time.time()
+    try:
+        diagram = RenderFile(filename, profiler=profiler, **options)
+    except (Exception, SystemExit) as err:
+        return filename, None, "{:}: {:}".format(type(err).__name__, err), time.time() - start, 0, None
+    report = None
+    if profiler is not None:
+        report = profiler.Report()
+        report["input"] = filename
+    return filename, ", ".join(diagram.OutputNames()), None, time.time() - start, diagram.renderCount, report
+
+def ExpandInputs(patterns):
+    # input files may be given directly or as glob patterns
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if len(matches) == 0:
+            # let the worker report the missing file
+            matches = [pattern]
+        for name in matches:
+            if name not in files:
+                files.append(name)
+    return files
+
+def OutputClashes(filenames, formats=None):
+    """
+    Reads every input before anything is rendered and returns {input:
+    message} for the inputs whose output file an earlier input writes
+    too. Inputs that cannot be read are left to the worker to report.
+    """
+    writers = {}
+    clashes = {}
+    for filename in filenames:
+        try:
+            diagram = ReadAny(filename)
+        except (Exception, SystemExit):
+            continue
+        diagram.formats = formats
+        for name in diagram.OutputNames():
+            first = writers.setdefault(os.path.abspath(name), filename)
+            if first != filename:
+                print("ERROR: " + filename + " would overwrite " + name + ", the output of " + first + ".")
+                clashes[filename] = "output {:} is also written by {:}".format(name, first)
+                break
+    return clashes
+
+def RenderBatch(filenames, processes=None, **options):
+    """
+    Renders many input files on a pool of worker processes that stay alive
+    for the whole batch. Keyword options are passed on to RenderFile, and
+    profile=True adds a profile report (see ProfileFile) to every result.
+    Returns a list of (input, output, error, seconds, renders, report)
+    tuples in the order of filenames; output is None when the file failed.
+    An input whose output file an earlier input writes too is not
+    rendered and fails.
+    """
+    job = functools.partial(_BatchJob, options=options)
+    clashes = OutputClashes(filenames, options.get("formats"))
+    results = {filename: (filename, None, error, 0.0, 0, None) for filename, error in clashes.items()}
+    jobs = [filename for filename in filenames if filename not in clashes]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(jobs)))
+    if processes == 1 and jobs:
+        _WarmWorker()
+        for filename in jobs:
+            results[filename] = job(filename)
+    elif jobs:
+        pool = multiprocessing.Pool(processes, initializer=_WarmWorker)
+        try:
+            for result in pool.imap_unordered(job, jobs):
+                results[result[0]] = result
+        finally:
+            pool.close()
+            pool.join()
+    return [results[filename] for filename in filenames]
+
+def WriteReport(filename, report):
+    with open(filename, 'w') as out:
+        json.dump(report, out, indent=1)
+    print("Profile report written to " + filename)
+
+def PrintBatchSummary(results):
+    failed = 0
+    print("o=======================================================o")
+    print("         Batch summary")
+    print("o=======================================================o")
+    for filename, outName, error, seconds, renders, _ in results:
+        if error is None:
+            print("  OK    {:}  ->  {:}  ({:.2f} s, {:} render(s))".format(filename, outName, seconds, renders))
+        else:
+            failed += 1
+            print("  FAIL  {:}  ({:})".format(filename, error))
+    print("{:} of {:} diagrams made, {:} failed.".format(len(results) - failed, len(results), failed))
+    return failed
 
 ######################################################################################################
 #           Main driver function
 ######################################################################################################
 def main():
 
+    parser = argparse.ArgumentParser(description="Plot an energy level diagram.")
+    parser.add_argument("inputs", nargs="*", metavar="INPUT FILE",
+                        help="input file(s), glob patterns are expanded")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of worker processes in batch mode (default: all cores)")
+    parser.add_argument("--label-solver", choices=["isotonic", "iterative"], default="isotonic",
+                        help="algorithm used to keep labels from overlapping (default: isotonic)")
+    parser.add_argument("--per-artist", action="store_true",
+                        help="draw every bar, connector and text as its own artist (slow for big diagrams)")
+    parser.add_argument("--mathtext", action="store_true",
+                        help="typeset labels with matplotlib's mathtext, LaTeX only for labels it cannot handle")
+    parser.add_argument("--label-cache", metavar="DIR",
+                        default=os.path.join(os.path.expanduser("~"), ".cache", "EnergyLeveller", "labels"),
+                        help="directory of the rendered LaTeX label cache")
+    parser.add_argument("--label-cache-size", type=float, default=64.0, metavar="MB",
+                        help="size limit of the label cache, 0 disables it (default: 64)")
+    parser.add_argument("--parse-cache", metavar="DIR",
+                        help="keep parsed inputs in DIR, unchanged inputs are not read again")
+    parser.add_argument("--check", action="store_true",
+                        help="only read the input(s) and lay out the labels, report errors and positions")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and render the input again whenever it changes")
+    parser.add_argument("--sequence", metavar="OUTPUT",
+                        help="render the inputs as the frames of one animation: a .gif, or numbered images")
+    parser.add_argument("--fps", type=float, default=2.0,
+                        help="frames per second of a --sequence animation (default: 2)")
+    parser.add_argument("--band", type=float, metavar="THRESHOLD",
+                        help="merge runs of states closer than THRESHOLD (energy units) into shaded bands")
+    parser.add_argument("--format", metavar="FORMATS",
+                        help="comma separated formats to save from one render, e.g. pdf,png,svg")
+    parser.add_argument("--profile", metavar="REPORT",
+                        help="write a JSON report with the time of every stage and other counters")
+    parser.add_argument("--cprofile", metavar="FILE",
+                        help="with --profile, also dump cProfile statistics (a single input only)")
+    args = parser.parse_args()
+    options = {"labelSolver": args.label_solver,
+               "useCollections": not args.per_artist,
+               "renderMode": "mathtext" if args.mathtext else "usetex",
+               "bandThreshold": args.band}
+    if args.format:
+        formats = [fmt.strip().lower().lstrip('.') for fmt in args.format.split(',') if fmt.strip()]
+        for fmt in formats:
+            if "." + fmt not in OUTPUT_FORMATS:
+                print("Unknown output format: " + fmt)
+                raise ValueError("Incorrect Arguments.")
+        options["formats"] = formats
+    if args.label_cache_size > 0:
+        options["labelCacheDir"] = args.label_cache
+        options["labelCacheSize"] = int(args.label_cache_size*1024*1024)
+    if args.parse_cache:
+        options["parseCacheDir"] = args.parse_cache
+
     print("o=======================================================o")
     print("         Beginning Energy Level Diagram")
     print("o=======================================================o")
-    if (len(sys.argv) == 1):
+    if (len(args.inputs) == 0):
         print("\nI need an input file!\n")
         raise IOError("No Input file provided.")
-    if (len(sys.argv) > 2):
-        print("Incorrect arguments. Correct call:\npython EnergyLeveler.py <INPUT FILE>")
-        raise ValueError("Incorrect Arguments.")
 
-    diagram = ReadInput(sys.argv[1])
-    diagram.MakeLeftRightPoints()
-    diagram.DrawBars()
-    diagram.DrawCanvas()
-    diagram.FindLabelPosition()
-    diagram.DrawLabels()
-    diagram.DrawEnergies()
-    diagram.DrawConnections()
-    diagram.Save()
+    inputs = ExpandInputs(args.inputs)
+    if args.check:
+        failed = 0
+        for filename in inputs:
+            try:
+                diagram = CheckFile(filename, **options)
+            except (Exception, SystemExit) as err:
+                failed += 1
+                print("FAIL  {:}  ({:}: {:})".format(filename, type(err).__name__, err))
+                continue
+            print("OK    {:}  ->  {:}".format(filename, ", ".join(diagram.OutputNames())))
+            PrintLabelPositions(diagram)
+        if failed:
+            sys.exit(1)
+        return
+    if args.sequence:
+        start = time.time()
+        names = RenderSequence(inputs, args.sequence, args.fps, **options)
+        print("{:} frame(s) of {:} written to {:} in {:.2f} s".format(len(inputs), args.sequence,
+                                                                    names[0] if len(names) == 1 else names[0] + " ...", time.time() - start))
+        return
+    if args.watch:
+        if (len(inputs) > 1):
+            print("Only one input file can be watched.")
+            raise ValueError("Incorrect Arguments.")
+        WatchFile(inputs[0], **options)
+        return
+    if (len(inputs) > 1):
+        if args.profile:
+            options["profile"] = True
+        results = RenderBatch(inputs, args.jobs, **options)
+        failed = PrintBatchSummary(results)
+        if args.profile:
+            WriteReport(args.profile, [result[5] for result in results if result[5] is not None])
+        if failed:
+            sys.exit(1)
+        return
+
+    if args.profile:
+        report = ProfileFile(inputs[0], args.cprofile, **options)
+        WriteReport(args.profile, report)
+        outName = report["output"]
+        renders = report["canvasDraws"]
+    else:
+        diagram = RenderFile(inputs[0], **options)
+        outName = ", ".join(diagram.OutputNames())
+        renders = diagram.renderCount
 
     print("o=======================================================o")
-    print("         Image "+diagram.outputName+" made!")
+    print("         Image "+outName+" made!")
+    print("         Figure rendered {:} time(s)".format(renders))
     print("o=======================================================o")
 
 if __name__ == "__main__":
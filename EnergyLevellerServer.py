@@ -0,0 +1,221 @@
+#!/opt/local/bin/python
+# coding=UTF-8
+
+"""
+Local render server for EnergyLeveller.
+
+Keeps a pool of worker processes with matplotlib already imported and
+serves diagrams over HTTP, so callers do not pay for a Python, matplotlib
+and LaTeX start up on every diagram:
+
+    python EnergyLevellerServer.py --port 8765 --workers 4
+    curl --data-binary @singlets.inp 'http://127.0.0.1:8765/render?format=png' > out.png
+
+Finished images are cached in memory under a hash of the parsed input and
+the render options, so an identical diagram is answered from the cache.
+"""
+from __future__ import print_function
+import io
+import json
+import time
+import argparse
+import threading
+import collections
+import concurrent.futures
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import EnergyLeveller as EL
+
+CONTENT_TYPES = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+    "pdf": "application/pdf",
+    "eps": "application/postscript",
+    "ps":  "application/postscript",
+}
+
+def RenderText(text, format, labelSolver, renderMode, labelCacheDir):
+    # runs in a worker process
+    if labelCacheDir is not None:
+        EL.UseLabelCache(labelCacheDir, 64*1024*1024)
+    diagram = EL.ParseInput(io.StringIO(text), "diagram.pdf")
+    diagram.labelSolver = labelSolver
+    diagram.renderMode = renderMode
+    try:
+        diagram.Draw()
+        return diagram.RenderBytes(format)
+    finally:
+        if diagram.fig is not None:
+            EL.plt.close(diagram.fig)
+
+def UsesImages(text):
+    # True when any line of the input sets the image key
+    for line in text.splitlines():
+        key, equals, _ = line.partition('=')
+        if equals and EL._Key(key) == "IMAGE":
+            return True
+    return False
+
+class ResultCache:
+    """
+    Least recently used store of rendered images, bounded in total bytes.
+    """
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def Get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def Put(self, key, data):
+        if len(data) > self.maxBytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = data
+            self.size += len(data)
+            while self.size > self.maxBytes:
+                _, old = self._entries.popitem(last=False)
+                self.size -= len(old)
+
+class RenderService:
+    """
+    Pool of warm workers behind a bounded queue. Render() answers from the
+    cache when it can, refuses work when the queue is full and gives up on
+    requests that take longer than the timeout.
+    """
+    def __init__(self, workers, queueLimit, timeout, cacheBytes, labelCacheDir=None):
+        self.timeout = timeout
+        self.labelCacheDir = labelCacheDir
+        self.cache = ResultCache(cacheBytes)
+        self.pool = concurrent.futures.ProcessPoolExecutor(workers, initializer=EL._WarmWorker)
+        self._slots = threading.BoundedSemaphore(queueLimit)
+        # start every worker now rather than on the first requests
+        for future in [self.pool.submit(time.sleep, 0) for _ in range(workers)]:
+            future.result()
+
+    def Render(self, text, format, labelSolver, renderMode):
+        """
+        Returns (status, body, cached). Parsing happens here, without
+        matplotlib, so bad inputs and cache hits never reach a worker.
+        """
+        if UsesImages(text):
+            # the path would be read from the server's disk
+            return 400, b"The image key is not accepted by the server.", False
+        try:
+            diagram = EL.ParseInput(io.StringIO(text), "diagram.pdf")
+        except (Exception, SystemExit) as err:
+            return 400, "{:}: {:}".format(type(err).__name__, err).encode('utf-8'), False
+        key = diagram.Fingerprint(format, labelSolver, renderMode)
+        data = self.cache.Get(key)
+        if data is not None:
+            return 200, data, True
+        if not self._slots.acquire(blocking=False):
+            return 503, b"Render queue is full, try again later.", False
+        try:
+            future = self.pool.submit(RenderText, text, format, labelSolver, renderMode, self.labelCacheDir)
+        except Exception:
+            self._slots.release()
+            raise
+        # a render that timed out keeps its worker busy, so its slot is only
+        # given back once it has really finished
+        future.add_done_callback(lambda done: self._slots.release())
+        try:
+            data = future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            return 504, b"Rendering took too long.", False
+        except Exception as err:
+            return 500, "{:}: {:}".format(type(err).__name__, err).encode('utf-8'), False
+        self.cache.Put(key, data)
+        return 200, data, False
+
+    def Stats(self):
+        return {"cacheEntries": len(self.cache._entries), "cacheBytes": self.cache.size,
+                "cacheHits": self.cache.hits, "cacheMisses": self.cache.misses}
+
+    def Close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+class RenderHandler(BaseHTTPRequestHandler):
+    # POST /render?format=png[&solver=iterative][&mathtext=1] with the input as body
+    service = None
+
+    def do_GET(self):
+        if urlparse(self.path).path != "/health":
+            self.Reply(404, b"Not found.", "text/plain")
+            return
+        self.Reply(200, json.dumps(self.service.Stats()).encode('utf-8'), "application/json")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/render":
+            self.Reply(404, b"Not found.", "text/plain")
+            return
+        query = parse_qs(url.query)
+        format = query.get("format", ["png"])[0].lower()
+        labelSolver = query.get("solver", ["isotonic"])[0]
+        renderMode = "mathtext" if query.get("mathtext", ["0"])[0] in ("1", "true", "yes") else "usetex"
+        if format not in CONTENT_TYPES or labelSolver not in ("isotonic", "iterative"):
+            self.Reply(400, b"Unknown format or label solver.", "text/plain")
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        text = self.rfile.read(length).decode('utf-8')
+        status, body, cached = self.service.Render(text, format, labelSolver, renderMode)
+        contentType = CONTENT_TYPES[format] if status == 200 else "text/plain"
+        self.Reply(status, body, contentType, {"X-Cache": "hit" if cached else "miss"})
+
+    def Reply(self, status, body, contentType, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve EnergyLeveller diagrams over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of warm worker processes (default: all cores)")
+    parser.add_argument("--queue", type=int, default=32,
+                        help="requests rendering or waiting at once, more are refused (default: 32)")
+    parser.add_argument("--timeout", type=float, default=60.0,
+                        help="seconds a request may take before it is given up (default: 60)")
+    parser.add_argument("--cache-size", type=float, default=256.0, metavar="MB",
+                        help="memory for finished images (default: 256)")
+    parser.add_argument("--label-cache", metavar="DIR", default=None,
+                        help="directory of the rendered LaTeX label cache shared by the workers")
+    args = parser.parse_args()
+
+    workers = args.workers or EL.multiprocessing.cpu_count()
+    service = RenderService(workers, args.queue, args.timeout,
+                            int(args.cache_size*1024*1024), args.label_cache)
+    RenderHandler.service = service
+    server = ThreadingHTTPServer((args.host, args.port), RenderHandler)
+    print("Serving diagrams on http://{:}:{:}/render with {:} workers".format(args.host, args.port, workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down.")
+    finally:
+        server.server_close()
+        service.Close()
+
+if __name__ == "__main__":
+    main()
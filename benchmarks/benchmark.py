@@ -0,0 +1,168 @@
+#!/opt/local/bin/python
+# coding=UTF-8
+
+"""
+Benchmarks for EnergyLeveller.
+
+Synthetic input files of growing size are generated and every stage of the
+pipeline is timed on its own, together with the peak memory of the run.
+Results can be stored as a baseline and later runs compared against it:
+
+    python benchmarks/benchmark.py --save-baseline baseline.json
+    python benchmarks/benchmark.py --compare baseline.json
+"""
+from __future__ import print_function
+import sys
+import os.path
+import json
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import EnergyLeveller as EL
+
+# name: (states, columns, energy spread, crowding)
+CASES = {
+    "tiny":    (10,     2,  5.0, 0.0),
+    "small":   (100,    4,  5.0, 0.2),
+    "medium":  (1000,   6,  5.0, 0.3),
+    "large":   (10000,  8, 10.0, 0.3),
+    "crowded": (2000,   1,  1.0, 0.9),
+    "banded":  (5000,   2,  1.0, 0.9),
+    "linked":  (1000,   4,  5.0, 0.3),
+}
+# extra settings of some cases, for MakeInput and for the render
+CASE_INPUTS = {"linked": {"links": 0.5}}
+CASE_OPTIONS = {"banded": {"bandThreshold": 0.001}}
+
+def MakeInput(filename, states, columns, spread, crowding, seed=0, links=0.0):
+    """
+    Writes a synthetic input file. Energies are spread uniformly over
+    [0, spread], except a `crowding` fraction of the states that is packed
+    into a window of 2% of the spread, the worst case for label layout.
+    A `links` fraction of the states links to a state in the next column.
+    """
+    rng = np.random.default_rng(seed)
+    crowded = int(round(crowding * states))
+    energies = rng.uniform(0.0, spread, states - crowded)
+    centre = rng.uniform(0.1, 0.9) * spread
+    packed = centre + rng.uniform(-0.01, 0.01, crowded) * spread
+    energies = np.concatenate([energies, packed])
+    rng.shuffle(energies)
+    outName = os.path.splitext(filename)[0] + ".png"
+    with open(filename, 'w') as out:
+        out.write("output-file = {:}\nwidth = 8\nheight = 8\n".format(outName))
+        out.write("energy-units = $E$ (eV)\nfont size = 12\n\n")
+        for i, energy in enumerate(energies):
+            out.write("{\n")
+            out.write("\tname = s{:}\n".format(i))
+            out.write("\ttext-colour = black\n")
+            out.write("\tlabel = $S_{{{:}}}$\n".format(i))
+            out.write("\tenergy = {:.6f}\n".format(energy))
+            out.write("\tlabelColour = black\n")
+            out.write("\tcolumn = {:}\n".format(i % columns + 1))
+            if i % columns < columns - 1 and i + 1 < states and rng.random() < links:
+                out.write("\tlinksto = s{:}\n".format(i + 1))
+            out.write("}\n\n")
+
+def TimeStages(filename, options):
+    # the stages of a real run, timed by the Profiler that --profile uses
+    profiler = EL.Profiler()
+    EL.RenderFile(filename, profiler=profiler, **options)
+    times = {}
+    for stage in profiler.Report()["stages"]:
+        times[stage["name"]] = times.get(stage["name"], 0.0) + stage["wall"]
+    times["total"] = sum(times.values())
+    return times
+
+def PeakMemory(filename, options):
+    # peak of Python allocations over a full run, in MB
+    tracemalloc.start()
+    try:
+        EL.RenderFile(filename, **options)
+        return tracemalloc.get_traced_memory()[1] / 1024.0**2
+    finally:
+        tracemalloc.stop()
+
+def RunCase(name, directory, renderMode, repeat):
+    filename = os.path.join(directory, name + ".inp")
+    MakeInput(filename, *CASES[name], **CASE_INPUTS.get(name, {}))
+    options = dict(CASE_OPTIONS.get(name, {}), renderMode=renderMode)
+    runs = [TimeStages(filename, options) for _ in range(repeat)]
+    # best of the repeats is the least noisy estimate
+    times = {stage: min(run[stage] for run in runs) for stage in runs[0]}
+    return {"states": CASES[name][0], "times": times, "peakMB": PeakMemory(filename, options)}
+
+def PrintResults(results):
+    # not every case runs every stage (bands, for one), list them all
+    stages = []
+    for result in results.values():
+        stages.extend(stage for stage in result["times"] if stage not in stages)
+    stages.sort(key=lambda stage: stage == "total")
+    print("{:<10}{:>8}".format("case", "states") + "".join("{:>20}".format(stage) for stage in stages) + "{:>10}".format("peak MB"))
+    for name, result in results.items():
+        line = "{:<10}{:>8}".format(name, result["states"])
+        line += "".join("{:>20.4f}".format(result["times"][stage]) if stage in result["times"] else "{:>20}".format("-")
+                        for stage in stages)
+        line += "{:>10.1f}".format(result["peakMB"])
+        print(line)
+
+def Compare(results, baseline, tolerance):
+    """
+    Lists (case, stage, baseline, now) for every stage that got slower than
+    tolerance times its baseline, or whose peak memory grew by as much.
+    Very short stages are skipped, they are mostly timer noise.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        for stage, seconds in result["times"].items():
+            before = old["times"].get(stage)
+            if before is not None and seconds > 0.01 and seconds > tolerance * before:
+                regressions.append((name, stage, before, seconds))
+        if result["peakMB"] > tolerance * old["peakMB"]:
+            regressions.append((name, "peakMB", old["peakMB"], result["peakMB"]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every stage of EnergyLeveller on synthetic inputs.")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES),
+                        help="which inputs to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, the best one is kept")
+    parser.add_argument("--usetex", action="store_true", help="render with LaTeX instead of mathtext")
+    parser.add_argument("--save-baseline", metavar="FILE", help="store the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="flag regressions against a stored baseline")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="slow down factor counted as a regression (default: 1.5)")
+    args = parser.parse_args()
+
+    renderMode = "usetex" if args.usetex else "mathtext"
+    results = {}
+    directory = tempfile.mkdtemp(prefix="EnergyLeveller-bench-")
+    # matplotlib is imported on first use, do it here so MakeFigure of the
+    # first case is not charged for it
+    EL.ImportMatplotlib()
+    for name in args.cases:
+        results[name] = RunCase(name, directory, renderMode, args.repeat)
+    PrintResults(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as out:
+            json.dump(results, out, indent=1, sort_keys=True)
+        print("Baseline saved to " + args.save_baseline)
+    if args.compare:
+        with open(args.compare) as inp:
+            baseline = json.load(inp)
+        regressions = Compare(results, baseline, args.tolerance)
+        for name, stage, before, now in regressions:
+            print("REGRESSION  {:}/{:}: {:.4f} -> {:.4f}".format(name, stage, before, now))
+        if regressions:
+            sys.exit(1)
+        print("No regressions against " + args.compare)
+
+if __name__ == "__main__":
+    main()
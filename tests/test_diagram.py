@@ -0,0 +1,100 @@
+import io
+
+import pytest
+
+import EnergyLeveller as EL
+
+HEADER = "output-file = out.png\nwidth = 8\nheight = 8\n"
+
+def Input(states):
+    # states as (name, energy, column[, linksto])
+    text = HEADER
+    for state in states:
+        text += "{{\nname = {:}\ntext-colour = black\nlabel-colour = black\nlabel = {:}\nenergy = {:}\ncolumn = {:}\n".format(
+            state[0], state[0], state[1], state[2])
+        if len(state) > 3:
+            text += "linksto = {:}\n".format(state[3])
+        text += "}\n"
+    return text
+
+def Load(states, bandThreshold=None):
+    diagram = EL.ParseInput(io.StringIO(Input(states)))
+    diagram.renderMode = "mathtext"
+    diagram.bandThreshold = bandThreshold
+    diagram.MakeBands()
+    return diagram
+
+BASE = [("a", 0.0, 1), ("b", 1.0, 1), ("c", 2.0, 1),
+        ("d", 0.0, 2), ("e", 1.0, 2), ("f", 2.0, 2),
+        ("g", 0.0, 3), ("h", 1.0, 3), ("i", 2.0, 3)]
+
+@pytest.fixture
+def drawn():
+    diagram = Load(BASE)
+    diagram.Draw()
+    yield diagram
+    EL.plt.close(diagram.fig)
+
+def test_update_lays_out_only_changed_columns(drawn):
+    states = [("e", 1.2, 2) if state[0] == "e" else state for state in BASE]
+    assert drawn.Update(Load(states)) == {1}
+    assert drawn.statesList["E"].energy == 1.2
+
+def test_update_counts_moved_added_and_removed_states(drawn):
+    # h moves from column 3 to column 1, d is removed and x added in column 2
+    states = [("h", 1.0, 1) if state[0] == "h" else state for state in BASE if state[0] != "d"]
+    states.append(("x", 1.5, 2))
+    assert drawn.Update(Load(states)) == {0, 1, 2}
+
+def test_update_without_changes(drawn):
+    positions = {name: state.labelPosition for name, state in drawn.statesList.items()}
+    assert drawn.Update(Load(BASE)) == set()
+    assert {name: state.labelPosition for name, state in drawn.statesList.items()} == positions
+
+def test_update_with_new_limits_lays_out_everything(drawn):
+    states = [("i", 3.0, 3) if state[0] == "i" else state for state in BASE]
+    assert drawn.Update(Load(states)) == {0, 1, 2}
+
+def test_update_counts_band_membership_changes():
+    cluster = [("p", 1.0, 1), ("q", 1.01, 1), ("r", 1.02, 1), ("s", 1.5, 1), ("z", 0.0, 2), ("y", 2.0, 2)]
+    diagram = Load(cluster, 0.05)
+    diagram.Draw()
+    try:
+        # s joins the band, the energies of its members stay as they were
+        moved = [("s", 1.03, 1) if state[0] == "s" else state for state in cluster]
+        fresh = Load(moved, 0.05)
+        assert diagram.Update(fresh) == {0}
+        assert diagram.bandMembers == fresh.bandMembers
+        assert diagram.bandMembers["S"] == "BAND 1.1"
+    finally:
+        EL.plt.close(diagram.fig)
+
+def test_bands_merge_runs_of_close_states():
+    states = [("a", 1.0, 1), ("b", 1.01, 1), ("c", 1.02, 1), ("d", 2.0, 1),
+              ("e", 3.0, 1), ("f", 3.01, 1), ("g", 1.005, 2, "a")]
+    diagram = Load(states, 0.05)
+    names = sorted(state.name for state in diagram.columnIndex[0])
+    assert names == ["BAND 1.1", "D", "E", "F"]
+    band = diagram.statesList["BAND 1.1"]
+    assert band.band == (1.0, 1.02, 3)
+    assert band.label == "3 states"
+    assert band.energy == pytest.approx(1.01)
+    assert {diagram.bandMembers[name] for name in "ABC"} == {"BAND 1.1"}
+    # G links to A, which is drawn as the band now
+    assert [(left.name, right.name) for left, right in diagram.LinkPairs()] == [("BAND 1.1", "G")]
+
+def test_bands_grow_until_the_labels_fit():
+    # thirty clusters of five states, more labels than the axis has room for
+    states = [("s{:}".format(5*k + j), 0.04*k + 0.002*j, 1) for k in range(30) for j in range(5)]
+    diagram = Load(states, 0.02)
+    diagram.ComputeLimits()
+    diagram.FindLabelPosition()
+    positions = [state.labelPosition for state in diagram.statesList.values()]
+    assert len(positions) < 30
+    assert min(positions) >= diagram.ylim[0]
+    assert max(positions) <= diagram.ylim[1]
+
+def test_no_bands_without_a_threshold():
+    diagram = Load([("a", 1.0, 1), ("b", 1.001, 1), ("c", 1.002, 1)])
+    assert sorted(diagram.statesList) == ["A", "B", "C"]
+    assert diagram.bandMembers == {}
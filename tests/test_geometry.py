@@ -0,0 +1,64 @@
+import numpy as np
+
+import EnergyLeveller as EL
+
+def test_segment_hits_box():
+    box = (1.0, 1.0, 2.0, 2.0)
+    assert EL.SegmentHitsBox((0.0, 0.0), (3.0, 3.0), box)
+    assert not EL.SegmentHitsBox((0.0, 0.0), (0.9, 0.9), box)
+    assert not EL.SegmentHitsBox((0.0, 2.5), (3.0, 2.5), box)
+    # vertical and horizontal segments, inside and outside the box
+    assert EL.SegmentHitsBox((1.5, 0.0), (1.5, 3.0), box)
+    assert not EL.SegmentHitsBox((2.5, 0.0), (2.5, 3.0), box)
+    assert EL.SegmentHitsBox((0.0, 1.5), (3.0, 1.5), box)
+    # touching an edge or a corner counts
+    assert EL.SegmentHitsBox((0.0, 2.0), (3.0, 2.0), box)
+    assert EL.SegmentHitsBox((0.0, 1.0), (1.0, 0.0), (1.0, 0.0, 2.0, 1.0))
+    # a single point
+    assert EL.SegmentHitsBox((1.5, 1.5), (1.5, 1.5), box)
+    assert not EL.SegmentHitsBox((0.5, 0.5), (0.5, 0.5), box)
+
+def test_grid_query_includes_edges_and_negative_cells():
+    index = EL.GridIndex(1.0, 1.0)
+    a = index.Insert((-2.5, -0.5, -1.5, 0.5))
+    b = index.Insert((0.0, 0.0, 0.5, 0.5))
+    c = index.Insert((3.0, -3.0, 3.0, 3.0))
+    assert index.Query(-2.0, 0.0, -2.0, 0.0) == {a}
+    assert index.Query(0.5, 0.5, 2.9, 1.0) == {b}
+    assert index.Query(-1.5, -0.5, 3.0, -0.5) == {a, c}
+    assert index.Query(1.0, 1.0, 2.0, 2.0) == set()
+
+def test_grid_segment_hits():
+    index = EL.GridIndex(1.0, 1.0)
+    index.Insert((2.2, 2.2, 2.8, 2.8))
+    index.Insert((-3.0, -3.0, -2.5, -2.5))
+    assert index.SegmentHits((0.0, 0.0), (5.0, 5.0))
+    # the same cells, but the segment passes the box
+    assert not index.SegmentHits((2.0, 2.9), (2.1, 2.0))
+    assert not index.SegmentHits((0.0, 5.0), (5.0, 3.5))
+    # vertical segments, also in negative cells, and reversed ends
+    assert index.SegmentHits((2.5, 10.0), (2.5, -10.0))
+    assert index.SegmentHits((-2.75, 0.0), (-2.75, -4.0))
+    assert not index.SegmentHits((-2.4, 0.0), (-2.4, -4.0))
+    assert EL.GridIndex(1.0, 1.0).SegmentHits((0.0, 0.0), (1.0, 1.0)) is False
+
+def test_free_intervals():
+    assert EL.FreeIntervals([], 0.1, 0.0, 1.0) == ([0.0], [1.0])
+    # blocks widened by the gap, overlapping ones merged, in any order
+    lows, highs = EL.FreeIntervals([(0.6, 0.7), (0.2, 0.3), (0.25, 0.4)], 0.05, 0.0, 1.0)
+    assert np.allclose(lows, [0.0, 0.45, 0.75])
+    assert np.allclose(highs, [0.15, 0.55, 1.0])
+    # blocks reaching past the limits
+    assert EL.FreeIntervals([(-1.0, 0.5), (0.9, 2.0)], 0.0, 0.0, 1.0) == ([0.5], [0.9])
+    # nothing free
+    assert EL.FreeIntervals([(-1.0, 2.0)], 0.1, 0.0, 1.0) == ([], [])
+
+def test_nearest_free():
+    lows, highs = [0.0, 0.5], [0.2, 0.8]
+    assert EL.NearestFree(lows, highs, 0.1) == 0.1
+    assert EL.NearestFree(lows, highs, 0.5) == 0.5
+    assert EL.NearestFree(lows, highs, 0.3) == 0.2
+    assert EL.NearestFree(lows, highs, 0.45) == 0.5
+    assert EL.NearestFree(lows, highs, -1.0) == 0.0
+    assert EL.NearestFree(lows, highs, 2.0) == 0.8
+    assert EL.NearestFree([], [], 0.5) is None
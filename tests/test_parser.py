@@ -0,0 +1,85 @@
+import io
+
+import pytest
+
+import EnergyLeveller as EL
+
+HEADER = "output-file = out.pdf\nwidth = 8\nheight = 8\n"
+
+def Parse(text, outputName=None):
+    return EL.ParseInput(io.StringIO(text), outputName)
+
+def test_key_spellings():
+    diagram = Parse("OUTPUT_FILE = out.pdf\nWidth\t= 8\nHEIGHT = 6\nfont size = 12\nEnergy-Units = eV\n"
+                    "{\nname = a\ntext colour = red\nLabel-Colour = blue\nenergy = 1.5\ncolumn = 2\n"
+                    "LINKS TO = b\nlabel offset = 0.5, -1\nimage_offset = 1, 2\n}\n"
+                    "{\nNAME = b\nTEXT-COLOR = green\nlabelColor = black\nENERGY = 2\nCOLUMN = 1\n}\n")
+    assert (diagram.outputName, diagram.width, diagram.height) == ("out.pdf", 8, 6)
+    assert (diagram.fontSize, diagram.energyUnits) == (12, "eV")
+    a = diagram.statesList["A"]
+    assert (a.color, a.labelColor, a.energy, a.column, a.linksTo) == ("RED", "BLUE", 1.5, 1, "B")
+    assert a.labelOffset == (0.5, -1.0)
+    assert a.imageOffset == (1.0, 2.0)
+    assert diagram.statesList["B"].color == "GREEN"
+    assert diagram.columns == 2
+
+def test_label_keeps_equals_sign():
+    diagram = Parse(HEADER + "{\nname = a\nlabel = $a = b$\nenergy = 0\ncolumn = 1\n}\n")
+    assert diagram.statesList["A"].label == "$a = b$"
+
+def test_errors_are_collected_with_line_numbers():
+    text = HEADER + ("{\nname = a\nenergy = low\ncolumn = 1\n}\n"
+                     "{\nname = b\nenergy = 1\ncolumn = first\n}\n"
+                     "{\nname = a\nenergy = 2\ncolumn = 1\n}\n")
+    with pytest.raises(EL.InputError) as info:
+        Parse(text)
+    assert info.value.errors == [(6, "Could not read real number for energy"),
+                                 (12, "Could not read integer for column number"),
+                                 (14, "State A is defined twice")]
+
+def test_missing_output_name():
+    text = "width = 8\nheight = 8\n{\nname = a\nenergy = 0\ncolumn = 1\n}\n"
+    with pytest.raises(EL.InputError) as info:
+        Parse(text)
+    assert info.value.errors == [(None, "Output name not set")]
+    assert Parse(text, "fallback.pdf").outputName == "fallback.pdf"
+
+def test_missing_size_is_reported_with_other_errors():
+    with pytest.raises(EL.InputError) as info:
+        Parse("output-file = out.pdf\n{\nname = a\nenergy = x\ncolumn = 1\n}\n")
+    assert info.value.errors == [(4, "Could not read real number for energy"),
+                                 (None, "Height not set"), (None, "Width not set")]
+
+def test_parsed_cache_miss_then_hit(tmp_path):
+    filename = tmp_path / "diagram.inp"
+    filename.write_text(HEADER + "{\nname = a\nenergy = 1\ncolumn = 1\n}\n")
+    cache = EL.ParsedCache(str(tmp_path / "cache"))
+    first = cache.Fetch(str(filename), EL.ReadInput)
+    second = cache.Fetch(str(filename), EL.ReadInput)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert second is not first
+    assert second.statesList["A"].energy == first.statesList["A"].energy == 1.0
+
+    # another cache on the same directory finds the entry on disk
+    other = EL.ParsedCache(str(tmp_path / "cache"))
+    other.Fetch(str(filename), EL.ReadInput)
+    assert (other.hits, other.misses) == (1, 0)
+
+def test_parsed_cache_rereads_changed_input(tmp_path):
+    filename = tmp_path / "diagram.inp"
+    filename.write_text(HEADER + "{\nname = a\nenergy = 1\ncolumn = 1\n}\n")
+    cache = EL.ParsedCache()
+    cache.Fetch(str(filename), EL.ReadInput)
+    filename.write_text(HEADER + "{\nname = a\nenergy = 2.5\ncolumn = 1\n}\n")
+    diagram = cache.Fetch(str(filename), EL.ReadInput)
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert diagram.statesList["A"].energy == 2.5
+
+def test_parsed_cache_ignores_entries_of_another_state_layout(tmp_path, monkeypatch):
+    filename = tmp_path / "diagram.inp"
+    filename.write_text(HEADER + "{\nname = a\nenergy = 1\ncolumn = 1\n}\n")
+    EL.ParsedCache(str(tmp_path / "cache")).Fetch(str(filename), EL.ReadInput)
+    # a slot added without bumping VERSION
+    monkeypatch.setattr(EL.State, "__slots__", EL.State.__slots__ + ("added",))
+    later = EL.ParsedCache(str(tmp_path / "cache"))
+    assert later._Load(later.Key(str(filename))) is None
@@ -0,0 +1,44 @@
+import numpy as np
+
+import EnergyLeveller as EL
+
+def Gaps(positions, spread, spacing):
+    # neighbour gaps in the order of the input positions, with the room they need
+    order = np.argsort(positions, kind='stable')
+    room = np.broadcast_to(np.asarray(spacing, dtype=float), positions.shape)[order]
+    return np.diff(spread[order]), 0.5 * (room[:-1] + room[1:])
+
+def test_random_labels_keep_spacing_and_bounds():
+    rng = np.random.default_rng(2024)
+    for _ in range(300):
+        n = int(rng.integers(1, 40))
+        lower, upper = 0.0, float(rng.uniform(5.0, 20.0))
+        positions = rng.uniform(lower, upper, n)
+        if rng.random() < 0.5:
+            spacing = float(rng.uniform(0.0, 0.9 * upper / n))
+        else:
+            spacing = rng.uniform(0.0, 0.9 * upper / n, n)
+        spread = EL.SpreadLabels(positions, spacing, lower, upper)
+        gaps, needed = Gaps(positions, spread, spacing)
+        assert np.all(gaps >= needed - 1e-9)
+        assert spread.min() >= lower - 1e-9
+        assert spread.max() <= upper + 1e-9
+
+def test_labels_with_room_stay_put():
+    positions = np.array([3.0, 1.0, 5.0, 9.0])
+    assert np.allclose(EL.SpreadLabels(positions, 1.0, 0.0, 10.0), positions)
+
+def test_crowded_labels_move_symmetrically():
+    spread = EL.SpreadLabels([5.0, 5.0, 5.0], 1.0, 0.0, 10.0)
+    assert np.allclose(np.sort(spread), [4.0, 5.0, 6.0])
+
+def test_roof_wins_when_labels_cannot_fit():
+    # four labels need 3 units between the bounds 0 and 2: the top one sits on
+    # the roof and the spacing is kept, so the lowest ones fall below the floor
+    spread = EL.SpreadLabels([1.0, 0.5, 1.5, 1.2], 1.0, 0.0, 2.0)
+    assert np.isclose(spread.max(), 2.0)
+    assert np.allclose(np.sort(spread), [-1.0, 0.0, 1.0, 2.0])
+    assert np.allclose(spread, [0.0, -1.0, 2.0, 1.0])
+
+def test_empty_input():
+    assert len(EL.SpreadLabels([], 1.0, 0.0, 1.0)) == 0
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+import EnergyLeveller as EL
+
+def test_csv_values_are_stripped(tmp_path):
+    filename = tmp_path / "states.csv"
+    filename.write_text("name, energy, column, label, colour\na, 1.0, 1, A, red\nb, 2.5, 2, B , blue\n\n")
+    diagram = EL.ReadTable(str(filename))
+    a, b = diagram.statesList["A"], diagram.statesList["B"]
+    assert (a.label, a.color, a.energy, a.column) == ("A", "RED", 1.0, 0)
+    assert (b.label, b.color, b.energy, b.column) == ("B", "BLUE", 2.5, 1)
+    assert diagram.outputName == str(tmp_path / "states.pdf")
+
+def test_table_without_rows_is_rejected(tmp_path):
+    filename = tmp_path / "empty.csv"
+    filename.write_text("name,energy,column\n")
+    with pytest.raises(ValueError):
+        EL.ReadTable(str(filename))
+
+def test_fractional_columns_are_rejected():
+    with pytest.raises(ValueError):
+        EL.DiagramFromArrays(["a", "b"], [1.0, 2.0], [1, 1.7])
+    diagram = EL.DiagramFromArrays(["a", "b"], [1.0, 2.0], np.array([1.0, 3.0]))
+    assert [state.column for state in diagram.statesList.values()] == [0, 2]
+    assert diagram.columns == 3
+
+def test_byte_strings_are_decoded(tmp_path):
+    filename = tmp_path / "states.npz"
+    np.savez(filename, name=np.array([b"a", b"b"]), energy=[0.0, 1.0], column=[1, 2],
+             label=np.array([b"$S_0$", b"$S_1$"], dtype="S8"))
+    diagram = EL.ReadTable(str(filename))
+    assert diagram.statesList["B"].label == "$S_1$"
+
+def test_duplicate_names_are_rejected():
+    with pytest.raises(ValueError):
+        EL.DiagramFromArrays(["a", "A"], [1.0, 2.0], [1, 2])